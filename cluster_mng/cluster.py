@@ -1,5 +1,34 @@
 # pylint: disable-all
 import logging as log
+import os
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DIAGS_REMOTE_PATH = "/var/diags"
+DIAGS_LOCAL_PATH = "artefacts/diags"
+MAX_DIAG_WORKERS = 32
+
+
+def download_diags(ssh, ip, test):
+    """ Download the diags of a single node into artefacts/diags/<test>/<ip>
+
+    :param paramiko.SSHClient ssh: connected ssh client for the node
+    :param str ip: ip of the node
+    :param str test: name of the test related subdirectory used to store the diags
+    """
+    dest = os.path.join(DIAGS_LOCAL_PATH, test, ip)
+    os.makedirs(dest, exist_ok=True)
+    # one tar stream per node instead of a round-trip per file
+    _, stdout, _ = ssh.exec_command(f"tar -C {DIAGS_REMOTE_PATH} -cz .")
+    with tarfile.open(fileobj=stdout, mode="r|gz") as tar:
+        # the stream comes from a remote node, the data filter rejects absolute paths,
+        # ../ escapes and links pointing outside dest
+        tar.extractall(dest, filter="data")
+    exit_status = stdout.channel.recv_exit_status()
+    if exit_status != 0:
+        raise AssertionError(f"tar of {DIAGS_REMOTE_PATH} failed on {ip} ({exit_status})")
+    log.info(f"diags for node {ip} downloaded to {dest}")
 
 
 class Cluster:
@@ -7,6 +36,54 @@ class Cluster:
     """
     def __init__(self, cfg=None):
         self.cfg = cfg
+        # ssh connections kept open between diag collections, keyed by (ip, username)
+        self.ssh_clients = {}
+        self.ssh_clients_lock = threading.Lock()
+
+    def get_ssh_client(self, ip, username, password):
+        """ Returns a connected ssh client for the node, reusing the open one if it is still active
+
+        Host keys are checked against ~/.ssh/known_hosts: a node whose key changed is rejected,
+        a node missing from it is accepted with a logged warning (test clusters are re-imaged often),
+        its key is not verified
+
+        :param str ip: ip of the node
+        :param str username: node username
+        :param str password: node password
+        :return: connected ssh client
+        :rtype: paramiko.SSHClient
+        """
+        import paramiko
+
+        key = (ip, username)
+        with self.ssh_clients_lock:
+            ssh = self.ssh_clients.get(key)
+        if ssh is not None:
+            transport = ssh.get_transport()
+            if transport is not None and transport.is_active():
+                return ssh
+            ssh.close()
+        ssh = paramiko.SSHClient()
+        # ~/.ssh/known_hosts, a missing file is ignored
+        ssh.load_system_host_keys()
+        ssh.set_missing_host_key_policy(paramiko.WarningPolicy())
+        ssh.connect(ip, username=username, password=password)
+        with self.ssh_clients_lock:
+            self.ssh_clients[key] = ssh
+        return ssh
+
+    def close_ssh_clients(self):
+        """ Close all the cached ssh connections
+        """
+        with self.ssh_clients_lock:
+            for ssh in self.ssh_clients.values():
+                ssh.close()
+            self.ssh_clients.clear()
+
+    def download_node_diags(self, ip, test, username, password):
+        """ Download the diags of a single node over its cached ssh connection
+        """
+        download_diags(self.get_ssh_client(ip, username, password), ip, test)
 
     def collect_diags(self, test_name):
         """ diagnostic collection, used by a couple of fixtures
@@ -17,6 +94,8 @@ class Cluster:
             log.info(f'diags collection requested for test: {test_name}')
 
         self.download_cluster_diags(test_name)
+        if test_name == "sessionfinish":
+            self.close_ssh_clients()
 
     def download_cluster_diags(self, test):
         """ Download diags for a cluster in parallel
@@ -30,29 +109,32 @@ class Cluster:
 
         :param str test: name of the test related subdirectory used to store the diags
         :param dict cluster_cfg: an optional cluster configuration object
-        :return: always returns good since we don't see what the thread function returns
+        :return: always returns good, per node failures are logged
         :rtype: bool
         """
-        # node_ips = []
-        # for node in [self.cfg["leader"]] + self.cfg["followers"]:
-        #     node_ips.append(node["ip"])
-        # username = self.cfg["node_username"]
-        # password = self.cfg["node_password"]
-        #
-        #
+        if not self.cfg:
+            log.info(f"no cluster configuration, skipping diag downloads for test {test}")
+            return True
+        node_ips = [node["ip"] for node in [self.cfg["leader"]] + self.cfg["followers"]]
+        username = self.cfg["node_username"]
+        password = self.cfg["node_password"]
+
         log.info(f"diag downloads starting for test {test}")
-        #
-        # # kick off all the download threads
-        # threads = []
-        # for ip in node_ips:
-        #     thread = Thread(target=download_diags, args=(ip, test, username, password))
-        #     threads.append(thread)
-        #     thread.start()
-        #
-        # # wait for all the downloads to complete
-        # for thread in threads:
-        #     thread.join()
-        #
-        # # log and return
-        # log.info(f"{len(threads)} diag files downloaded for test {test}")
-        # return True
\ No newline at end of file
+
+        # kick off the downloads on a bounded pool, a failing node doesn't stall the others
+        downloaded = 0
+        with ThreadPoolExecutor(max_workers=min(MAX_DIAG_WORKERS, len(node_ips))) as executor:
+            futures = {
+                executor.submit(self.download_node_diags, ip, test, username, password): ip
+                for ip in node_ips
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    downloaded += 1
+                except Exception as exc:
+                    log.error(f"diag download failed for node {futures[future]}: {exc}")
+
+        # log and return
+        log.info(f"{downloaded} diag files downloaded for test {test}")
+        return True
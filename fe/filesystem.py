@@ -4,6 +4,11 @@ import errno
 import random
 import os.path
 
+CREATE_FILE_IGNORED_ERRORS = frozenset([errno.ENOENT, errno.EEXIST, errno.EISDIR, errno.ENOTDIR])
+CREATE_DIR_IGNORED_ERRORS = frozenset([errno.ENOENT, errno.EEXIST, errno.ENOTDIR])
+OPEN_IGNORED_ERRORS = frozenset([errno.ENOENT, errno.ENOTDIR])
+READ_IGNORED_ERRORS = frozenset([errno.ENOENT, errno.EISDIR, errno.ENOTDIR])
+
 
 class FileSystem:
     """Class for filesystem objects in which fs operations can be applied.
@@ -17,22 +22,20 @@ class FileSystem:
         """
         Function to create file on given path
         """
-        log.debug(f"Creating file {file_path}, root_mount is: {self.mount_path}")
+        log.debug("Creating file %s, root_mount is: %s", file_path, self.mount_path)
 
         target_path = os.path.join(self.mount_path, file_path)
-        log.debug(f"  ** open({target_path})")
+        log.debug("  ** open(%s)", target_path)
         try:
-            with open(target_path, "x") as fd:
-                print(fd)
+            with open(target_path, "x"):
+                pass
         except IOError as e:
             if e.errno == errno.EROFS:
                 return e
-            if e.errno not in frozenset(
-                    [errno.ENOENT, errno.EEXIST, errno.EISDIR, errno.ENOTDIR]
-            ):
-                log.debug(f"{target_path} open error({e.errno}): {e.strerror}")
+            if e.errno not in CREATE_FILE_IGNORED_ERRORS:
+                log.debug("%s open error(%s): %s", target_path, e.errno, e.strerror)
                 raise AssertionError
-        log.debug(f"Exit create_file for: {target_path}")
+        log.debug("Exit create_file for: %s", target_path)
 
     def create_dir(self, dir_path):
         """
@@ -40,20 +43,18 @@ class FileSystem:
         """
         target_path = os.path.join(self.mount_path, dir_path)
 
-        log.debug(f"Creating dir {target_path}, root_mount is: {self.mount_path}")
+        log.debug("Creating dir %s, root_mount is: %s", target_path, self.mount_path)
 
-        log.debug(f"  ** mkdir({target_path})")
+        log.debug("  ** mkdir(%s)", target_path)
         try:
             os.mkdir(f"{target_path}")
         except IOError as e:
             if e.errno == errno.EROFS:
                 return e
-            if e.errno not in frozenset(
-                    [errno.ENOENT, errno.EEXIST, errno.ENOTDIR]
-            ):
-                log.debug(f"{target_path} mkdir error({e.errno}):  {e.strerror}")
+            if e.errno not in CREATE_DIR_IGNORED_ERRORS:
+                log.debug("%s mkdir error(%s):  %s", target_path, e.errno, e.strerror)
                 raise AssertionError
-        log.debug(f"Exit create_dir for: {target_path}")
+        log.debug("Exit create_dir for: %s", target_path)
 
     def read_file(self, file_path, io_size=None):
         """
@@ -62,63 +63,71 @@ class FileSystem:
         """
         # Test path
         target_path = os.path.join(self.mount_path, file_path)
+        log.debug("** read(%s)", target_path)
         try:
-            old_size = os.stat(f"{target_path}").st_size
-            if not io_size:
-                io_size = old_size
+            # open directly rather than stat first, the size comes from the open fd
+            test_fd = os.open(target_path, os.O_RDONLY)
         except IOError as e:
-            if e.errno not in frozenset([errno.ENOENT, errno.ENOTDIR]):
-                log.debug(f"{target_path} stat error({e.errno}): {e.strerror}")
+            if e.errno not in OPEN_IGNORED_ERRORS:
+                log.debug("%s open error(%s): %s", target_path, e.errno, e.strerror)
                 raise AssertionError
             else:
                 return
-        read_len = random.randrange(1, io_size)
-        if old_size > 0:
-            # Pick an offset which may result in a short read
-            offset = random.randrange(0, old_size)
-        else:
-            offset = 0
-        log.debug(f"Reading from file '{target_path}' file_size: {old_size} offset: {offset} "
-                  f"len: {read_len}"
-                  )
-        log.debug(f"** read({target_path})")
         try:
-            with open(f"{target_path}", "r") as test_fd:
-                test_fd.seek(offset)
-                read_buffer = test_fd.read(read_len)
-                log.debug(f"  Length read returned: {len(read_buffer)}")
-                # We will see either string.ascii_letters or NULL in the data.
-                # While we don't write NULL, if a file is truncated to be smaller
-                # in between write_file fetching the old file size and writing,
-                # we'll get NULL chars in the data.
+            old_size = os.fstat(test_fd).st_size
+            if not io_size:
+                io_size = old_size
+            read_len = random.randrange(1, io_size)
+            if old_size > 0:
+                # Pick an offset which may result in a short read
+                offset = random.randrange(0, old_size)
+            else:
+                offset = 0
+            log.debug("Reading from file '%s' file_size: %s offset: %s len: %s",
+                      target_path, old_size, offset, read_len)
+            read_buffer = os.pread(test_fd, read_len, offset)
+            log.debug("  Length read returned: %s", len(read_buffer))
+            # We will see either string.ascii_letters or NULL in the data.
+            # While we don't write NULL, if a file is truncated to be smaller
+            # in between write_file fetching the old file size and writing,
+            # we'll get NULL chars in the data.
         except IOError as e:
             # If we got EIO, check for the file having been replaced with a dir or
             # deleted, since this can cause FUSE to return EIO internally, even if
             # the test filesystem did not return any error.
             if e.errno == errno.EIO:
                 if os.path.exists(target_path) and os.path.isfile(target_path):
-                    log.debug(f"{file_path} read error({e.errno}): {e.strerror} '{target_path}'")
+                    log.debug("%s read error(%s): %s '%s'", file_path, e.errno, e.strerror, target_path)
                     raise AssertionError
                 else:
-                    log.debug(f"Ignoring EIO since '{target_path}' is not a file")
+                    log.debug("Ignoring EIO since '%s' is not a file", target_path)
                     return
-            if e.errno not in frozenset(
-                    [errno.ENOENT, errno.EISDIR, errno.ENOTDIR]
-            ):
-                log.debug(f"{target_path} read error({e.errno}): {e.strerror}")
+            if e.errno not in READ_IGNORED_ERRORS:
+                log.debug("%s read error(%s): %s", target_path, e.errno, e.strerror)
                 raise AssertionError
-        log.debug(f"Exit read_file for: {target_path}")
+        finally:
+            os.close(test_fd)
+        log.debug("Exit read_file for: %s", target_path)
 
     def listdir(self, dir_path):
         """
         Function to list dir
         """
         target_path = os.path.join(self.mount_path, dir_path)
-        log.debug(f"listdir: '{target_path}'")
-        list_dir = os.listdir(target_path)
-        log.debug(f"Exit listdir for: {target_path}")
+        log.debug("listdir: '%s'", target_path)
+        list_dir = [entry.name for entry in self.iscandir(dir_path)]
+        log.debug("Exit listdir for: %s", target_path)
         return list_dir
 
+    def iscandir(self, dir_path):
+        """
+        Function to iterate over the entries of a dir, yields os.DirEntry objects
+        so callers can use the file type returned by readdir without an extra stat
+        """
+        target_path = os.path.join(self.mount_path, dir_path)
+        with os.scandir(target_path) as entries:
+            yield from entries
+
     def write_file(self, file_path, towrite, split=None):
         """
         Function to write some data to a file
@@ -126,14 +135,15 @@ class FileSystem:
         # towrite is a string
         target_path = os.path.join(self.mount_path, file_path)
         data = towrite.encode()
-        log.debug(f"write_file: '{target_path}' length:{len(data)}")
+        log.debug("write_file: '%s' length:%s", target_path, len(data))
         try:
             fd = -1
             fd = os.open(target_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC)
             if split:
+                # both halves go out in a single writev syscall
                 split_index = int(len(data) / split)
-                os.write(fd, data[0:split_index])
-                os.write(fd, data[split_index:])
+                view = memoryview(data)
+                os.writev(fd, [view[:split_index], view[split_index:]])
             else:
                 os.write(fd, data)
             os.close(fd)
@@ -141,7 +151,7 @@ class FileSystem:
             if fd != -1:
                 os.close(fd)
             raise
-        log.debug(f"Exit write_file for: {target_path}")
+        log.debug("Exit write_file for: %s", target_path)
 
     def write_file_offset(self, file_path, writedata, offset):
         """
@@ -149,9 +159,11 @@ class FileSystem:
         """
         target_path = os.path.join(self.mount_path, file_path)
         data = writedata.encode()
-        log.debug(f"write_file_offset: '{target_path}' length:{len(data)} offset:{offset}")
-        with open(target_path, "ab") as fd:
-            fd.seek(offset, os.SEEK_SET)
-            fd.write(data)
-        fd.close()
-        log.debug(f"Exit write_file in offset {offset} for: {target_path}")
+        log.debug("write_file_offset: '%s' length:%s offset:%s", target_path, len(data), offset)
+        # pwrite honours the offset, O_APPEND ("ab") would always write at EOF
+        fd = os.open(target_path, os.O_WRONLY | os.O_CREAT)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+        log.debug("Exit write_file in offset %s for: %s", offset, target_path)
@@ -1,31 +1,65 @@
 # pylint: disable-all
 
+import copy
 import logging as log
 import json
+import os
 import tempfile
+from functools import lru_cache
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from utils import run_shell_command, convert_size, format_units_time, format_units_iops
 
+# (report item, fio key) pairs, reported for read and write plus total/average
+READ_WRITE_METRICS = (("bandwidth", "bw_bytes"), ("iops", "iops"))
+# (report item, fio key) pairs, reported from the job summary itself
+JOB_METRICS = (("cpu", "usr_cpu"), ("disk_util", "disk_util"))
+# (fio disk_util key, default) pairs kept per device
+DISK_STAT_DEFAULTS = (
+    ("read_ios", 0),
+    ("write_ios", 0),
+    ("read_ticks", 0),
+    ("write_ticks", 0),
+    ("in_queue", 0),
+    ("util", 0.0),
+)
+
+
+@lru_cache(maxsize=32)
+def _load_fio_config(config_path, mtime_ns):
+    """Read and parse the fio config file, cached on path and modification time"""
+    with open(config_path, 'r') as config_json:
+        fio_config = json.load(config_json)
+    log.info("Completed reading fio config file")
+    return fio_config
+
 
 def parse_fio_config(config):
     """
     Parse the fio config file and return a dictionary
     fio config will have all command line options
     required to run fio.
+    The parsed config is cached until the file changes,
+    callers get their own copy so changing it doesn't affect later calls.
     """
-    with open(config, 'r') as config_json:
-        fio_config = json.load(config_json)
-    log.info("Completed reading fio config file")
-    return fio_config
+    config_path = os.path.abspath(config)
+    return copy.deepcopy(_load_fio_config(config_path, os.stat(config_path).st_mtime_ns))
 
 
-def run_fio(fio_config, job_file):
+def run_fio(fio_config, job_file, output_file=None):
     """
     Run fio tool with the given config and job file
+    If output_file is given, fio writes its results there instead of stdout,
+    pass it to FioResult_Parser as results_path.
     """
     log.info("Parsing fio options")
     fio_config = parse_fio_config(fio_config)
     log.info(f"Running fio with the job file - {job_file}")
-    fio_cmd = f"fio {job_file} --output-format={fio_config['output_format']}"
+    fio_cmd = ["fio", job_file, f"--output-format={fio_config['output_format']}"]
+    if output_file:
+        fio_cmd.append(f"--output={output_file}")
     ret = run_shell_command(fio_cmd)
     if ret.returncode != 0:
         log.error(f"Error running fio - {ret.returncode}")
@@ -47,9 +81,10 @@ def fio_log_perf(operation, unit, value):
 
 def replace_fio_file_path(jobfile, file_path):
     """Create a temp file with the test_filepath required in specific tests"""
-    with open(jobfile) as f:
-        jobdata = f.read().replace("filename=/tmp", f"filename={file_path}")
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', suffix='.fio') as temp_jobfile:
+    # work on bytes, no need to decode the job file just to swap the path
+    with open(jobfile, 'rb') as f:
+        jobdata = f.read().replace(b"filename=/tmp", f"filename={file_path}".encode())
+    with tempfile.NamedTemporaryFile(delete=False, mode='wb', suffix='.fio') as temp_jobfile:
         temp_jobfile.write(jobdata)
         temp_jobfile_path = temp_jobfile.name
     return temp_jobfile_path
@@ -57,9 +92,17 @@ def replace_fio_file_path(jobfile, file_path):
 class FioResult_Parser:
     """Parse and log FIO results."""
 
-    def __init__(self, jobfile, results_str, reportitem):
-        index = results_str.index('{')
-        self.fio_output = json.loads(results_str[index:])
+    def __init__(self, jobfile, results_str, reportitem, results_path=None):
+        if results_path:
+            with open(results_path, 'rb') as results_file:
+                self.fio_output = orjson.loads(results_file.read()) if orjson else json.load(results_file)
+        else:
+            index = results_str.index('{')
+            if orjson:
+                self.fio_output = orjson.loads(results_str[index:])
+            else:
+                # skip anything fio printed before the json document without copying the string
+                self.fio_output = json.JSONDecoder().raw_decode(results_str, index)[0]
         self.summary = self.fio_output['jobs'][0]
         self.jobname = self.summary["jobname"]
         self.reportitem = reportitem
@@ -67,48 +110,37 @@ class FioResult_Parser:
     def get_disk_stats(self):
         """Extract disk stats from the FIO output."""
         disk_stats = self.fio_output.get('disk_util', [])
-        stats = {}
-        for stat in disk_stats:
-            device = stat.get('name')
-            if device:
-                stats[device] = {
-                    "read_ios": stat.get('read_ios', 0),
-                    "write_ios": stat.get('write_ios', 0),
-                    "read_ticks": stat.get('read_ticks', 0),
-                    "write_ticks": stat.get('write_ticks', 0),
-                    "in_queue": stat.get('in_queue', 0),
-                    "util": stat.get('util', 0.0)
-                }
+        stats = {
+            stat['name']: {key: stat.get(key, default) for key, default in DISK_STAT_DEFAULTS}
+            for stat in disk_stats if stat.get('name')
+        }
         return stats
 
     def summarize(self):
-        metrics = {
-            "bandwidth": {"read": "bw_bytes", "write": "bw_bytes"},
-            "iops": {"read": "iops", "write": "iops"},
-            "latency": {"read": "lat_ns", "write": "lat_ns"},
-            "cpu": "usr_cpu",
-            "disk_util": "disk_util"
-        }
-        for metric, keys in metrics.items():
-            if self.reportitem.get(metric):
-                if isinstance(keys, dict):
-                    for op, key in keys.items():
-                        value = self.summary[op][key] if metric != "latency" else self.summary[op][key]["mean"]
-                        fio_log_perf(op, metric, value)
-                    if metric != "latency":
-                        total = sum(self.summary[op][key] for op in keys)
-                        fio_log_perf("total", metric, total)
-                        fio_log_perf("average", metric, total / len(keys))
-                    else:
-                        if (self.summary["read"]["lat_ns"]["mean"] > 0.0 and
-                                self.summary["write"]["lat_ns"]["mean"] > 0.0):
-                            avg_latency = (self.summary["read"]["lat_ns"]["mean"] + self.summary["write"]["lat_ns"][
-                                "mean"]) / 2
-                            fio_log_perf("average", metric, avg_latency)
-                else:
-                    value = self.summary.get(keys, None)
-                    if value is not None:
-                        fio_log_perf(metric, metric, value)
+        report = self.reportitem
+        read = self.summary["read"]
+        write = self.summary["write"]
+        for metric, key in READ_WRITE_METRICS:
+            if report.get(metric):
+                read_value = read[key]
+                write_value = write[key]
+                fio_log_perf("read", metric, read_value)
+                fio_log_perf("write", metric, write_value)
+                total = read_value + write_value
+                fio_log_perf("total", metric, total)
+                fio_log_perf("average", metric, total / 2)
+        if report.get("latency"):
+            read_latency = read["lat_ns"]["mean"]
+            write_latency = write["lat_ns"]["mean"]
+            fio_log_perf("read", "latency", read_latency)
+            fio_log_perf("write", "latency", write_latency)
+            if read_latency > 0.0 and write_latency > 0.0:
+                fio_log_perf("average", "latency", (read_latency + write_latency) / 2)
+        for metric, key in JOB_METRICS:
+            if report.get(metric):
+                value = self.summary.get(key, None)
+                if value is not None:
+                    fio_log_perf(metric, metric, value)
         # Log disk stats
         disk_stats = self.get_disk_stats()
         for device, stats in disk_stats.items():
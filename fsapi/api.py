@@ -1,16 +1,125 @@
 # pylint: disable-all
+import importlib
 import sys
-import logging as log
-from datetime import datetime, timezone
+import time
+import logging
+from datetime import datetime
+from collections import OrderedDict
+from functools import lru_cache
+from operator import attrgetter
 from fsapi.filesystem import FileSystem
 from fsapi.static import (
+    AttributeFlags,
     OpRequirements,
     verify_returned_flag_field,
     STAT_INFO_ATTRS,
     EXTRA_INFO_ATTRS,
-    filetime_to_dt,
+    EPOCH_AS_FILETIME,
+    HUNDREDS_OF_NANOSECONDS,
+    dt_to_filetime,
 )
 
+_LOGGER = logging.getLogger(__name__)
+
+ATTR_CACHE_SIZE = 256
+MOUNT_INFO_CLASSES = {
+    "gfs": "GfsMountInfo",
+    "sofs": "SofsMountInfo",
+    "fsapi": "PassthruMountInfo",
+}
+# operations whose target doesn't exist before (its FileInfo is passed in op_args)
+CREATE_OPS = frozenset(["create_file", "mkdir", "symlink"])
+# operations whose target doesn't exist after
+REMOVE_OPS = frozenset(["unlink", "rmdir"])
+# parent values meaning the target lives at the root
+ROOT_PARENTS = frozenset([None, "/", ""])
+# special_fields group: (FileInfo it applies to, index of stat/extra info in the FileInfo tuple)
+SPECIAL_FIELDS_GROUPS = (
+    ("stat_parent", "parent", 0),
+    ("extra_parent", "parent", 1),
+    ("stat_target", "target", 0),
+    ("extra_target", "target", 1),
+)
+STAT_INFO_ATTRS_SET = frozenset(STAT_INFO_ATTRS)
+EXTRA_INFO_ATTRS_SET = frozenset(EXTRA_INFO_ATTRS)
+# requested return flag: bit expected in the returned attrs flags
+RETURN_ATTR_FLAG_BITS = {
+    "return_pre_op_attr": AttributeFlags.PRE_OP,
+    "return_stat_post_op_attr": AttributeFlags.STAT_POST_OP,
+    "return_extra_post_op_attr": AttributeFlags.EXTRA_POST_OP,
+}
+RETURN_ATTR_FLAGS = frozenset(RETURN_ATTR_FLAG_BITS)
+
+
+def return_flags_mask(req):
+    """Returns the AttributeFlags bitmask expected for the requested return flags
+    :param set req: requested flags
+    """
+    mask = 0
+    for flag in RETURN_ATTR_FLAGS & req:
+        mask |= RETURN_ATTR_FLAG_BITS[flag]
+    return mask
+
+
+def attrs_getter(attr_list):
+    """Returns a callable fetching all attributes in attr_list from an object as a tuple
+    :param list attr_list: attribute names
+    """
+    getter = attrgetter(*attr_list)
+    if len(attr_list) == 1:
+        return lambda obj: (getter(obj),)
+    return getter
+
+
+@lru_cache(maxsize=ATTR_CACHE_SIZE)
+def cached_attrs_getter(attr_tuple):
+    """attrs_getter memoized per tuple of attribute names, so repeated comparisons
+    of the same field set reuse one getter
+    :param tuple attr_tuple: attribute names
+    """
+    return attrs_getter(attr_tuple)
+
+
+def _diff(obj1, obj2, getter, attr_list):
+    """Returns the first attribute of attr_list that differs between both objects,
+    None if all match. Fields are only walked one by one when the tuples differ
+    :param callable getter: attrs_getter(attr_list)
+    :param list attr_list: attribute names
+    """
+    values1 = getter(obj1)
+    values2 = getter(obj2)
+    if values1 == values2:
+        return None
+    for attr, val1, val2 in zip(attr_list, values1, values2):
+        if val1 != val2:
+            return attr
+
+
+def assert_attrs_match(attr_list, getter, obj1, obj2):
+    """Asserts that all attributes in attr_list match in both objects
+    :param list attr_list: attribute names
+    :param callable getter: attrs_getter(attr_list)
+    """
+    field = _diff(obj1, obj2, getter, attr_list)
+    if field is not None:
+        val1, val2 = getattr(obj1, field), getattr(obj2, field)
+        raise AssertionError(f"{field} does not match after operation: {val1} vs {val2}")
+
+
+def split_file_info(file_info):
+    """Returns the (stat info, extra info) pair of a get_attr result, (None, None) if missing
+    :param tuple file_info: get_attr result
+    """
+    if not file_info:
+        return None, None
+    return file_info[0], file_info[1]
+
+
+STAT_INFO_GETTER = attrs_getter(STAT_INFO_ATTRS)
+STAT_INFO_NO_SIZE_ATTRS = tuple(att for att in STAT_INFO_ATTRS if att not in ("length", "bytes_used"))
+STAT_INFO_NO_SIZE_GETTER = attrs_getter(STAT_INFO_NO_SIZE_ATTRS)
+EXTRA_INFO_GETTER = attrs_getter(EXTRA_INFO_ATTRS)
+
 
 class FsApiWrapper:
     """Class to use as fsapi Wraper for calls to C++ functions.
@@ -22,31 +131,43 @@ class FsApiWrapper:
     depending on the mode.
     """
 
-    def __init__(self, fs_type, root_code_path):
-        self.fs_type = fs_type
-        # Load the corresponding library depending on fs type
-        if self.fs_type == "gfs":
-            # Append to python path the folder containing the pybind .so library compiled
-            sys.path.append(f"{root_code_path}/bazel-bin/src")
-            import libgfsfsapi as fsapi
-
-        elif self.fs_type == "sofs":
-            # Append to python path the folder containing the pybind .so library compiled
-            sys.path.append(f"{root_code_path}/bazel-bin/src")
-            import libhydrasofs as fsapi
-
-        elif self.fs_type == "fsapi":
-            # Append to python path the folder containing the pybind .so library compiled
-            sys.path.append(f"{root_code_path}/bazel-bin/src/examples")
-            import libpassthrufsapi as fsapi
+    # fs type: (folder under root_code_path containing the pybind .so, library name)
+    FSAPI_LIBS = {
+        "gfs": ("bazel-bin/src", "libgfsfsapi"),
+        "sofs": ("bazel-bin/src", "libhydrasofs"),
+        "fsapi": ("bazel-bin/src/examples", "libpassthrufsapi"),
+        "ufo": ("bazel-bin/src", "libufonanobind"),
+    }
+    _lib_cache = {}
 
-        elif self.fs_type == "ufo":
+    def __init__(self, fs_type, root_code_path, cache_attrs=False):
+        self.fs_type = fs_type
+        # get_attr results kept between check_op_flag_attr calls, keyed by (id(fs_obj), path).
+        # Only enable it when nothing but check_op_flag_attr modifies the checked paths.
+        self.cache_attrs = cache_attrs
+        self._attr_cache = OrderedDict()
+        # fsapi and sofs don't keep modified times stable across operations
+        self._base_stat_exc = (
+            ("metadata_modified_time", "userdata_modified_time")
+            if fs_type in ("fsapi", "sofs")
+            else ()
+        )
+        # Load the corresponding library depending on fs type,
+        # the pybind .so is only imported once per process for each type and code path
+        key = (fs_type, root_code_path)
+        fsapi = self._lib_cache.get(key)
+        if fsapi is None and fs_type in self.FSAPI_LIBS:
+            lib_dir, lib_name = self.FSAPI_LIBS[fs_type]
             # Append to python path the folder containing the pybind .so library compiled
-            sys.path.append(f"{root_code_path}/bazel-bin/src")
-            import libufonanobind as fsapi
+            sys.path.append(f"{root_code_path}/{lib_dir}")
+            fsapi = importlib.import_module(lib_name)
+            self._lib_cache[key] = fsapi
 
         # This is to be able to access fsapi lib
         self.fsapi = fsapi
+        self.mount_info_cls = (
+            getattr(fsapi, MOUNT_INFO_CLASSES[fs_type]) if fs_type in MOUNT_INFO_CLASSES else None
+        )
 
     def get_fsapi_version(self):
         """Returns fsapi version"""
@@ -66,23 +187,25 @@ class FsApiWrapper:
         """
         return node_api.ListFilesystems()
 
-    def open_filesystem(self, node_api, fs_id=None, subvolume_path=None):
+    def open_filesystem(
+        self, node_api, fs_id=None, subvolume_path=None, cache_inodes=False, batch_closes=False
+    ):
         """Returns a FileSystem object in which operations can be applied
         :param str node_api: API object for the fs
         :param int fs_id: id of the filesystem
+        :param bool cache_inodes: keep resolved inodes between get_inode calls
+        :param bool batch_closes: queue the Close of internally opened handles
         """
-        if self.fs_type == "gfs":
-            fs_mount = self.fsapi.GfsMountInfo()
-        elif self.fs_type == "sofs":
-            fs_mount = self.fsapi.SofsMountInfo()
-        elif self.fs_type == "fsapi":
-            fs_mount = self.fsapi.PassthruMountInfo()
+        if self.mount_info_cls:
+            fs_mount = self.mount_info_cls()
         elif self.fs_type == "ufo":
             fs_mount = "No mount"
         else:
             raise AssertionError(f"type {self.fs_type} not recognized")
         return FileSystem(
-            node_api, self.fsapi, fs_mount, self.fs_type, fs_id, subvolume_path
+            node_api, self.fsapi, fs_mount, self.fs_type, fs_id, subvolume_path,
+            cache_inodes=cache_inodes,
+            batch_closes=batch_closes,
         )
 
     def shutdown(self, node_api):
@@ -91,7 +214,43 @@ class FsApiWrapper:
         """
         node_api.Shutdown()
 
-    def compare_file_info(self, f_info1, f_info2, exceptions=[], only_these=[]):
+    def _cached_get_attr(self, fs_obj, file_path):
+        """Returns get_attr for file_path, from the attr cache if enabled
+        :param FileSystem fs_obj: filesystem object
+        :param str file_path: path of the file/dir
+        """
+        if not self.cache_attrs:
+            return fs_obj.get_attr(file_path=file_path)
+        key = (id(fs_obj), file_path)
+        file_info = self._attr_cache.get(key)
+        if file_info is None:
+            file_info = fs_obj.get_attr(file_path=file_path)
+            self._store_attr(fs_obj, file_path, file_info)
+        return file_info
+
+    def _store_attr(self, fs_obj, file_path, file_info):
+        """Stores get_attr result in the attr cache, oldest entry is evicted when full"""
+        if not self.cache_attrs:
+            return
+        self._attr_cache[(id(fs_obj), file_path)] = file_info
+        if len(self._attr_cache) > ATTR_CACHE_SIZE:
+            self._attr_cache.popitem(last=False)
+
+    def invalidate_attr_cache(self, fs_obj=None, *file_paths):
+        """Drops entries from the attr cache
+        :param FileSystem fs_obj: only drop entries of this filesystem, all if None
+        :param str file_paths: only drop these paths, all paths of fs_obj if none given
+        """
+        if fs_obj is None:
+            self._attr_cache.clear()
+        elif file_paths:
+            for file_path in file_paths:
+                self._attr_cache.pop((id(fs_obj), file_path), None)
+        else:
+            for key in [key for key in self._attr_cache if key[0] == id(fs_obj)]:
+                del self._attr_cache[key]
+
+    def compare_file_info(self, f_info1, f_info2, exceptions=None, only_these=None):
         """Compares each field of 2 FileInfo objects
         :param FileInfo f_info1: FileInfo object 1
         :param FileInfo f_info1: FileInfo object 1
@@ -99,20 +258,26 @@ class FsApiWrapper:
         :param list only_these: If not empty, only those fields will be compared,
         exceptions will still apply if provided.
         """
-        if len(only_these) > 0:
+        if only_these:
             attr_list = only_these
         else:
             if isinstance(f_info1, self.fsapi.StatInfo):
                 attr_list = STAT_INFO_ATTRS
             else:
                 attr_list = EXTRA_INFO_ATTRS
-        attr_list = [att for att in attr_list if att not in exceptions]
-        for attr in attr_list:
-            a = f_info1.__getattribute__(attr)
-            b = f_info2.__getattribute__(attr)
-            if a != b:
-                log.error(f"Attribute {attr} does not match: {a} Vs {b}")
-                return
+        if exceptions:
+            exceptions = frozenset(exceptions)
+            attr_list = [att for att in attr_list if att not in exceptions]
+        if not attr_list:
+            return True
+        attr_list = tuple(attr_list)
+        attr = _diff(f_info1, f_info2, cached_attrs_getter(attr_list), attr_list)
+        if attr is not None:
+            _LOGGER.error(
+                "Attribute %s does not match: %s Vs %s",
+                attr, getattr(f_info1, attr), getattr(f_info2, attr),
+            )
+            return
         return True
 
     def compare_all_attributes(
@@ -122,24 +287,36 @@ class FsApiWrapper:
         f_info_in,
         f_info_out,
         current_time,
-        extra_exceptions={"stat": [], "extra": []},
+        extra_exceptions=None,
     ):
         """Helper function to verify that file info attributes
          are updated when they should and not updated when they shouldn't
-        :param list req: list of requested flags
+        :param list req: list (or set) of requested flags
         :param PrePostAttributes attrs: FileInfo object 1
         :param FileInfo f_info_in: file_info before operation
         :param FileInfo f_info_out: file_info after operation
-        :param datetime current_time: Time when op was executed,
+        :param int current_time: Time when op was executed, in filetime format,
+            a timezone aware datetime is also accepted
         :param dict extra_exceptions: If not empty, only those fields will be verified,
         """
+        req = req if isinstance(req, (set, frozenset)) else frozenset(req)
+        if isinstance(current_time, datetime):
+            # dt_to_filetime drops the sub-second part, add it back
+            current_time = dt_to_filetime(current_time) + current_time.microsecond * 10
+        if extra_exceptions is None:
+            extra_exceptions = {"stat": (), "extra": ()}
+        has_pre = "return_pre_op_attr" in req
+        has_stat_post = "return_stat_post_op_attr" in req
+        has_extra_post = "return_extra_post_op_attr" in req
+        stat_in, extra_in = split_file_info(f_info_in)
+        stat_out, extra_out = split_file_info(f_info_out)
         # If pre/post attrs are requested to be returned we'll need to check them
-        if "return_pre_op_attr" in req:
+        if has_pre:
             pre_attr = attrs.pre_op
             # Compare returned pre-attributes with the obtained by get_attr before operation
             # All fields must match
             assert self.compare_file_info(
-                f_info_in[0],
+                stat_in,
                 pre_attr,
                 only_these=[
                     "length",
@@ -148,78 +325,98 @@ class FsApiWrapper:
                 ],
                 exceptions=extra_exceptions["stat"],
             )
-        if "return_stat_post_op_attr" in req:
+        # Get what flags have been requested apart from return pre/post
+        req_fields = req - RETURN_ATTR_FLAGS
+        updated_stat = req_fields & STAT_INFO_ATTRS_SET
+        updated_extra = req_fields & EXTRA_INFO_ATTRS_SET
+        unknown = req_fields - updated_stat - updated_extra
+        if unknown:
+            raise AssertionError(f"fields {sorted(unknown)} not recognized")
+
+        # Nothing else to check if the target is gone after the operation (unlink/rmdir)
+        if not f_info_out:
+            return
+
+        if has_stat_post:
             # Compare returned stat post-attributes with the obtained by get_attr after operation
             # Non-requested fields must match, fields requested to update must differ
-            if f_info_out:
-                assert self.compare_file_info(
-                    f_info_out[0],
-                    attrs.stat_post_op,
-                    exceptions=extra_exceptions["stat"],
-                )
+            assert self.compare_file_info(
+                stat_out,
+                attrs.stat_post_op,
+                exceptions=extra_exceptions["stat"],
+            )
 
-        if "return_extra_post_op_attr" in req:
+        if has_extra_post:
             # Compare returned extra post-attributes with the obtained by get_attr after operation
             # Non-requested fields must match, fields requested to update must differ
-            if f_info_out:
-                assert self.compare_file_info(
-                    f_info_out[1],
-                    attrs.extra_post_op,
-                    exceptions=extra_exceptions["extra"],
-                )
-
-        # Get what flags have been requested apart from return pre/post
-        updated_fields = {"stat": [], "extra": []}
-        for field in req:
-            if field not in [
-                "return_pre_op_attr",
-                "return_stat_post_op_attr",
-                "return_extra_post_op_attr",
-            ]:
-                if field in STAT_INFO_ATTRS:
-                    updated_fields["stat"].append(field)
-                elif field in EXTRA_INFO_ATTRS:
-                    updated_fields["extra"].append(field)
-                else:
-                    raise AssertionError(f"field {field} not recognized")
+            assert self.compare_file_info(
+                extra_out,
+                attrs.extra_post_op,
+                exceptions=extra_exceptions["extra"],
+            )
 
         # Metadata modified time is always updated in sofs
         if self.fs_type == "sofs":
-            updated_fields["stat"].append("metadata_modified_time")
+            updated_stat = updated_stat | {"metadata_modified_time"}
 
         # Compare GetAttr before and after operation
         # Check that only requested attributes have been updated
-        if f_info_out:
-            assert self.compare_file_info(
-                f_info_out[0],
-                f_info_in[0],
-                exceptions=updated_fields["stat"] + extra_exceptions["stat"],
-            )
-            for req_attr in updated_fields["stat"]:
-                # The updated timestamp must be different after operation
-                if not (
-                    self.fs_type in ["fsapi", "sofs"]
-                    and req_attr in ["metadata_modified_time"]
-                ):
-                    assert f_info_in[0].__getattribute__(
-                        req_attr
-                    ) != f_info_out[0].__getattribute__(
-                        req_attr
-                    ), f"{req_attr} does not change"
-                    # The updated timestamp should be very close to current time
-                    dt_out = filetime_to_dt(
-                        f_info_out[0].__getattribute__(req_attr)
-                    )
-                    assert (current_time - dt_out).seconds == 0
+        assert self.compare_file_info(
+            stat_out,
+            stat_in,
+            exceptions=updated_stat.union(extra_exceptions["stat"]),
+        )
+        for req_attr in updated_stat:
+            # The updated timestamp must be different after operation
+            if not (
+                self.fs_type in ["fsapi", "sofs"]
+                and req_attr in ["metadata_modified_time"]
+            ):
+                value_out = getattr(stat_out, req_attr)
+                assert getattr(stat_in, req_attr) != value_out, f"{req_attr} does not change"
+                # The updated timestamp should be very close to current time (less than a second)
+                delta = current_time - value_out
+                assert 0 <= delta < HUNDREDS_OF_NANOSECONDS
 
         # Compare GetAttr before and after operation
         # Check that only requested attributes have been updated
-        if f_info_out:
-            assert self.compare_file_info(
-                f_info_out[1],
-                f_info_in[1],
-                exceptions=updated_fields["extra"] + extra_exceptions["extra"],
-            )
+        assert self.compare_file_info(
+            extra_out,
+            extra_in,
+            exceptions=updated_extra.union(extra_exceptions["extra"]),
+        )
+
+    @staticmethod
+    def check_special_fields(special_fields, key, file_info, phase, skip=()):
+        """Checks that the special fields of one group match the values in file_info
+        :param dict special_fields: fields that need special comparison,
+        :param str key: group of special_fields to check, e.g. "stat_parent"
+        :param FileInfo file_info: FileInfo object to check
+        :param str phase: "before" or "after" the operation
+        :param tuple skip: fields not to check
+        """
+        fields = [spf for spf in special_fields[key] if spf not in skip]
+        if not fields:
+            return
+        when = " after operation:" if phase == "after" else ""
+        for spf, val1 in zip(fields, cached_attrs_getter(tuple(fields))(file_info)):
+            val2 = special_fields[key][spf][phase]
+            assert val1 == val2, f"{spf} does not match{when} {val1} vs {val2}"
+
+    def _build_extra_exceptions(self, kind, opname, special_fields):
+        """Returns the fields compare_all_attributes must skip for parent or target
+        :param str kind: "parent" or "target"
+        :param str opname: name of the operation under test
+        :param dict special_fields: fields that need special comparison,
+        """
+        stat_exc = list(special_fields.get(f"stat_{kind}", []))
+        stat_exc.extend(exc for exc in self._base_stat_exc if exc not in stat_exc)
+        if self._base_stat_exc:
+            if kind == "parent" and opname == "symlink":
+                stat_exc.append("unix_mode")
+            elif kind == "target" and opname in CREATE_OPS:
+                stat_exc.extend(("created_time", "accessed_time"))
+        return {"stat": stat_exc, "extra": list(special_fields.get(f"extra_{kind}", []))}
 
     def check_op_flag_attr(
         self,
@@ -228,10 +425,10 @@ class FsApiWrapper:
         parent,
         target,
         op_args,
-        req_parent=[],
-        req_target=[],
+        req_parent=None,
+        req_target=None,
         op_flags=0,
-        special_fields={},
+        special_fields=None,
     ):
         """Helper function to check that all Pre/post attributes are correctly returned
         :param list api: fsapi wrapper object
@@ -244,43 +441,43 @@ class FsApiWrapper:
         :param int op_flags: req flags,
         :param dict special_fields: fields that need special comparison,
         """
+        opname = operation.__name__
+        req_parent = frozenset(req_parent or ())
+        req_target = frozenset(req_target or ())
+        if special_fields is None:
+            special_fields = {}
+        parent_flags = return_flags_mask(req_parent)
+        parent_pre = bool(parent_flags & AttributeFlags.PRE_OP)
+        parent_stat_post = bool(parent_flags & AttributeFlags.STAT_POST_OP)
+        parent_extra_post = bool(parent_flags & AttributeFlags.EXTRA_POST_OP)
+        target_flags = return_flags_mask(req_target)
+        target_pre = bool(target_flags & AttributeFlags.PRE_OP)
+        target_stat_post = bool(target_flags & AttributeFlags.STAT_POST_OP)
+        target_extra_post = bool(target_flags & AttributeFlags.EXTRA_POST_OP)
         # Call get_attr for parent and target
         target_path = (
             target
-            if operation.__name__ != "unlink" or parent in [None, "/", ""]
+            if opname != "unlink" or parent in ROOT_PARENTS
             else f"{parent}/{target}"
         )
         file_info_parent_before = (
-            fs_obj.get_attr(file_path=parent) if parent else None
+            self._cached_get_attr(fs_obj, parent) if parent else None
         )
-        if operation.__name__ in ["create_file", "mkdir", "symlink"]:
+        if opname in CREATE_OPS:
             file_info_target_before = (op_args[-2], op_args[-1])
         else:
             file_info_target_before = (
-                fs_obj.get_attr(file_path=target_path) if target else None
+                self._cached_get_attr(fs_obj, target_path) if target else None
             )
+        target_stat_before = split_file_info(file_info_target_before)[0]
 
         # Check special fields before operation
-        for spf in special_fields.get("stat_parent", []):
-            if spf != "bytes_used":
-                val1 = file_info_parent_before[0].__getattribute__(spf)
-                val2 = special_fields["stat_parent"][spf]["before"]
-                assert val1 == val2, f"{spf} does not match {val1} vs {val2}"
-        for spf in special_fields.get("extra_parent", []):
-            if spf != "bytes_used":
-                val1 = file_info_parent_before[1].__getattribute__(spf)
-                val2 = special_fields["extra_parent"][spf]["before"]
-                assert val1 == val2, f"{spf} does not match {val1} vs {val2}"
-        for spf in special_fields.get("stat_target", []):
-            if spf != "bytes_used":
-                val1 = file_info_target_before[0].__getattribute__(spf)
-                val2 = special_fields["stat_target"][spf]["before"]
-                assert val1 == val2, f"{spf} does not match {val1} vs {val2}"
-        for spf in special_fields.get("extra_target", []):
-            if spf != "bytes_used":
-                val1 = file_info_target_before[1].__getattribute__(spf)
-                val2 = special_fields["extra_target"][spf]["before"]
-                assert val1 == val2, f"{spf} does not match {val1} vs {val2}"
+        file_infos_before = {"parent": file_info_parent_before, "target": file_info_target_before}
+        for key, side, index in SPECIAL_FIELDS_GROUPS:
+            if special_fields.get(key):
+                self.check_special_fields(
+                    special_fields, key, file_infos_before[side][index], "before", skip=("bytes_used",)
+                )
 
         # Call Operation using requested flags
         req_flags = self.fsapi.RequestFlags()
@@ -294,47 +491,54 @@ class FsApiWrapper:
 
         op_ret = operation(*op_args, req_flags=req_flags)
         parent_attr, target_attr = op_ret[1:3]
-        current_time = datetime.now(timezone.utc)
+        # filetime of now, compared directly against the returned timestamps
+        current_time = EPOCH_AS_FILETIME + time.time_ns() // 100
+        if self.cache_attrs:
+            # rename may touch any path, otherwise only parent and target change
+            if opname == "rename":
+                self.invalidate_attr_cache(fs_obj)
+            else:
+                self.invalidate_attr_cache(fs_obj, parent, target_path)
 
         # Call get_attr for parent and target
-        if operation.__name__ in ["unlink", "rmdir"]:
+        if opname in REMOVE_OPS:
             file_info_target_out = None
         else:
             file_info_target_out = (
                 fs_obj.get_attr(file_path=target_path) if target else None
             )
+            if target:
+                self._store_attr(fs_obj, target_path, file_info_target_out)
         file_info_parent_out = (
             fs_obj.get_attr(file_path=parent) if parent else None
         )
+        if parent:
+            self._store_attr(fs_obj, parent, file_info_parent_out)
+        parent_stat_out, parent_extra_out = split_file_info(file_info_parent_out)
+        target_stat_out, target_extra_out = split_file_info(file_info_target_out)
 
         # First check that returned flags attr are consistent
         if parent_attr:
             assert verify_returned_flag_field(
-                parent_attr.flags,
-                stat_post="return_stat_post_op_attr" in req_parent,
-                extra_post="return_extra_post_op_attr" in req_parent,
-                pre="return_pre_op_attr" in req_parent,
+                parent_attr.flags, expected=parent_flags
             ), (
                 f"Error verifying flag: {parent_attr.flags},"
-                f" Pre provided: {'return_pre_op_attr' in req_parent},"
-                f" Post stat provided: {'return_stat_post_op_attr' in req_parent}"
-                f" Post extra provided: {'return_stat_post_op_attr' in req_parent}"
+                f" Pre provided: {parent_pre},"
+                f" Post stat provided: {parent_stat_post}"
+                f" Post extra provided: {parent_extra_post}"
             )
         if target_attr:
             if (
-                operation.__name__ not in ["unlink"]
-                or file_info_target_before[0].nlink > 1
+                opname != "unlink"
+                or target_stat_before.nlink > 1
             ):
                 assert verify_returned_flag_field(
-                    target_attr.flags,
-                    stat_post="return_stat_post_op_attr" in req_target,
-                    extra_post="return_extra_post_op_attr" in req_target,
-                    pre="return_pre_op_attr" in req_target,
+                    target_attr.flags, expected=target_flags
                 ), (
                     f"Error verifying flag: {target_attr.flags},"
-                    f" Pre provided: {'return_pre_op_attr' in req_target},"
-                    f" Post stat provided: {'return_stat_post_op_attr' in req_target}"
-                    f" Post extra provided: {'return_extra_post_op_attr' in req_target}"
+                    f" Pre provided: {target_pre},"
+                    f" Post stat provided: {target_stat_post}"
+                    f" Post extra provided: {target_extra_post}"
                 )
         # Check special fields after operation
         for flag in req_parent:
@@ -348,108 +552,61 @@ class FsApiWrapper:
             if special_fields.get("extra_target"):
                 special_fields["extra_target"].pop(flag, None)
 
-        for spf in special_fields.get("stat_parent", []):
-            if self.fs_type == "gfs" or spf not in ["bytes_used", "length"]:
-                val1 = file_info_parent_out[0].__getattribute__(spf)
-                val2 = special_fields["stat_parent"][spf]["after"]
-                assert (
-                    val1 == val2
-                ), f"{spf} does not match after operation: {val1} vs {val2}"
+        # bytes_used and length are only reliable after the operation on gfs
+        stat_skip = () if self.fs_type == "gfs" else ("bytes_used", "length")
+        if special_fields.get("stat_parent"):
+            self.check_special_fields(
+                special_fields, "stat_parent", parent_stat_out, "after", skip=stat_skip
+            )
 
         # Check values of returned parent_attr are correct if requested
-        if "return_stat_post_op_attr" in req_parent:
-            for field in STAT_INFO_ATTRS:
-                val3 = parent_attr.stat_post_op.__getattribute__(field)
-                val4 = file_info_parent_out[0].__getattribute__(field)
-                assert (
-                    val3 == val4
-                ), f"{field} does not match after operation: {val3} vs {val4}"
-
-        for spf in special_fields.get("extra_parent", []):
-            val1 = file_info_parent_out[1].__getattribute__(spf)
-            val2 = special_fields["extra_parent"][spf]["after"]
-            assert (
-                val1 == val2
-            ), f"{spf} does not match after operation: {val1} vs {val2}"
-
-        if operation.__name__ not in ["unlink", "rmdir"]:
-            for spf in special_fields.get("stat_target", []):
-                if self.fs_type == "gfs" or spf not in ["bytes_used", "length"]:
-                    val1 = file_info_target_out[0].__getattribute__(spf)
-                    val2 = special_fields["stat_target"][spf]["after"]
-                    assert (
-                        val1 == val2
-                    ), f"{spf} does not match after operation: {val1} vs {val2}"
+        if parent_stat_post:
+            assert_attrs_match(
+                STAT_INFO_ATTRS, STAT_INFO_GETTER, parent_attr.stat_post_op, parent_stat_out
+            )
+
+        if special_fields.get("extra_parent"):
+            self.check_special_fields(special_fields, "extra_parent", parent_extra_out, "after")
+
+        if opname not in REMOVE_OPS:
+            if special_fields.get("stat_target"):
+                self.check_special_fields(
+                    special_fields, "stat_target", target_stat_out, "after", skip=stat_skip
+                )
 
             # Check values of returned target_attr are correct if requested
-            if "return_stat_post_op_attr" in req_target:
-                for field in STAT_INFO_ATTRS:
-                    if (
-                        field not in ["length", "bytes_used"]
-                        or "stream" not in operation.__name__
-                    ):
-                        val3 = target_attr.stat_post_op.__getattribute__(field)
-                        val4 = file_info_target_out[0].__getattribute__(field)
-                        assert (
-                            val3 == val4
-                        ), f"{field} does not match after operation: {val3} vs {val4}"
-            for spf in special_fields.get("extra_target", []):
-                val1 = file_info_target_out[1].__getattribute__(spf)
-                val2 = special_fields["extra_target"][spf]["after"]
-                assert (
-                    val1 == val2
-                ), f"{spf} does not match after operation: {val1} vs {val2}"
-
-            if "return_extra_post_op_attr" in req_target:
-                for field in EXTRA_INFO_ATTRS:
-                    val3 = target_attr.extra_post_op.__getattribute__(field)
-                    val4 = file_info_target_out[1].__getattribute__(field)
-                    assert (
-                        val3 == val4
-                    ), f"{field} does not match after operation: {val3} vs {val4}"
+            if target_stat_post:
+                # length and bytes_used are not checked for stream operations
+                if "stream" in opname:
+                    fields, getter = STAT_INFO_NO_SIZE_ATTRS, STAT_INFO_NO_SIZE_GETTER
+                else:
+                    fields, getter = STAT_INFO_ATTRS, STAT_INFO_GETTER
+                assert_attrs_match(fields, getter, target_attr.stat_post_op, target_stat_out)
+            if special_fields.get("extra_target"):
+                self.check_special_fields(special_fields, "extra_target", target_extra_out, "after")
 
-        # Check the rest of fields
-        extra_exceptions = {
-            "stat": [spf for spf in special_fields.get("stat_parent", [])],
-            "extra": [spf for spf in special_fields.get("extra_parent", [])],
-        }
-        if self.fs_type in ["fsapi", "sofs"]:
-            if "metadata_modified_time" not in extra_exceptions["stat"]:
-                extra_exceptions["stat"].append("metadata_modified_time")
-            if "userdata_modified_time" not in extra_exceptions["stat"]:
-                extra_exceptions["stat"].append("userdata_modified_time")
-            if operation.__name__ == "symlink":
-                extra_exceptions["stat"].append("unix_mode")
+            if target_extra_post:
+                assert_attrs_match(
+                    EXTRA_INFO_ATTRS, EXTRA_INFO_GETTER, target_attr.extra_post_op, target_extra_out
+                )
 
+        # Check the rest of fields
         self.compare_all_attributes(
             req_parent,
             parent_attr,
             file_info_parent_before,
             file_info_parent_out,
             current_time,
-            extra_exceptions=extra_exceptions,
+            extra_exceptions=self._build_extra_exceptions("parent", opname, special_fields),
         )
 
-        extra_exceptions = {
-            "stat": [spf for spf in special_fields.get("stat_target", [])],
-            "extra": [spf for spf in special_fields.get("extra_target", [])],
-        }
-        if self.fs_type in ["fsapi", "sofs"]:
-            if "metadata_modified_time" not in extra_exceptions["stat"]:
-                extra_exceptions["stat"].append("metadata_modified_time")
-            if "userdata_modified_time" not in extra_exceptions["stat"]:
-                extra_exceptions["stat"].append("userdata_modified_time")
-            if operation.__name__ in ["create_file", "mkdir", "symlink"]:
-                extra_exceptions["stat"].append("created_time")
-                extra_exceptions["stat"].append("accessed_time")
-
         self.compare_all_attributes(
             req_target,
             target_attr,
             file_info_target_before,
             file_info_target_out,
             current_time,
-            extra_exceptions=extra_exceptions,
+            extra_exceptions=self._build_extra_exceptions("target", opname, special_fields),
         )
 
         return op_ret
@@ -1,12 +1,28 @@
 # pylint: disable-all
 import json
 import os
-import stat
 import errno
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from functools import cached_property
+from itertools import accumulate
 from fsapi.static import (
+    CLOSE_BATCH_SIZE,
+    HANDLE_CACHE_SIZE,
+    INODE_CACHE_SIZE,
+    IO_POOL_WORKERS,
     MAX_READDIR_ENTRIES,
-    STAT_TYPICAL_VALUES,
-    EXTRA_INFO_TYPICAL_VALUES, AccessModes,
+    S_IFDIR,
+    S_IFLNK,
+    S_IFREG,
+    WRITE_COALESCE_BYTES,
+    WRITE_COALESCE_COUNT,
+    AccessModes,
+    AttributeFlags,
+    apply_typical_stat,
+    apply_typical_extra_info,
+    split_path,
 )
 import json
 from pathlib import Path
@@ -18,6 +34,33 @@ import pathlib
 import time
 import logging as log
 
+# mockoon config of the VCM REST api used by the sofs snapshots, and the
+# placeholder snapshot name -> id entries it ships with
+VCM_MOCKOON_JSON = "/tmp/vcmLocalRESTForSOFS.json"
+VCM_MOCKOON_SNAPSHOTS = {
+    "testsnap-44": 22,
+    "testsnap-45": 23,
+    "testsnap-46": 24,
+}
+
+
+def read_vcm_mockoon():
+    """Returns the content of the VCM mockoon config"""
+    with open(VCM_MOCKOON_JSON) as mockoon_file:
+        return mockoon_file.read()
+
+
+def write_vcm_mockoon(data, replacements):
+    """Applies the (old, new) replacements to data in order, same as a chain
+    of sed substitutions, and writes it back as the VCM mockoon config
+    :param str data: content of the config, see read_vcm_mockoon
+    :param list replacements: (old, new) pairs
+    """
+    for old, new in replacements:
+        data = data.replace(old, new)
+    with open(VCM_MOCKOON_JSON, "w") as mockoon_file:
+        mockoon_file.write(data)
+
 
 class FileSystem:
     """Class for filesystem objects in which fs operations can be applied.
@@ -29,12 +72,57 @@ class FileSystem:
         or fsapi.SofsFSApi
         or fsapi.Passthru api: FS fsapi object created on Init for a node
     :param fsapi fsapi: fsapi object
+    :param bool cache_inodes: keep the inodes resolved by get_inode between calls,
+        only safe when this object is the only one modifying the namespace
+    :param bool batch_closes: queue the Close of handles opened internally
+        (autoclose paths) and send them in batches, see flush_closes
+    :param bool cache_handles: keep the handles write/read open by path between calls,
+        see flush_handles
+    :param bool lazy_close: write/read don't wait for the Close of the handles they open,
+        it runs on the io pool, see drain_closes
+    :param float attr_ttl: seconds get_attr serves the post-op attrs returned by
+        write/set_attr/open_file/create_file instead of calling GetAttr, 0 disables it
+    :param bool cache_xattrs: keep the result of get_all_xattrs by path until the
+        xattrs are changed through this object
     """
 
+    _FULL_ACCESS = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
+    # fs type: name of the handle class in its fsapi library
+    HANDLE_CLASSES = {
+        "gfs": "GfsHandle",
+        "sofs": "SofsHandle",
+        "fsapi": "PassthruHandle",
+    }
+
     def __init__(
-            self, api, fsapi, fs_mount, fs_type, fs_id=1, subvolume_path=None
+            self, api, fsapi, fs_mount, fs_type, fs_id=1, subvolume_path=None, cache_inodes=False,
+            batch_closes=False, cache_handles=False, attr_ttl=0, cache_xattrs=False,
+            lazy_close=False,
     ):
         self.fs_id = fs_id
+        # handles waiting to be closed when batch_closes is set
+        self.batch_closes = batch_closes
+        self._pending_closes = deque()
+        # futures of the Close calls sent to the io pool when lazy_close is set
+        self.lazy_close = lazy_close
+        self._lazy_closes = []
+        # (path, open_flags) -> handle kept open by write/read when cache_handles is set
+        self.cache_handles = cache_handles
+        self._handle_cache = OrderedDict()
+        # path -> [start offset, buffers, total length] of the contiguous writes
+        # accumulated by write_buffered
+        self._pending_writes = {}
+        # path -> (get_attr result, time.monotonic() when stored)
+        self.attr_ttl = attr_ttl
+        self._attr_cache = {}
+        # path -> {name: value} returned by get_all_xattrs
+        self.cache_xattrs = cache_xattrs
+        self._xattr_cache = {}
+        # normalized path -> inode, oldest entry is evicted when full.
+        # The batch ops resolve paths on the io pool threads, hence the lock
+        self.cache_inodes = cache_inodes
+        self._inode_cache = OrderedDict()
+        self._inode_cache_lock = threading.Lock()
         self.api = api
         self.fsapi = fsapi
         self.fs_type = fs_type
@@ -47,19 +135,311 @@ class FileSystem:
             self.fs_info = fs_id
         else:
             fs_info = self.api.OpenFilesystem(fs_mount)
-            assert fs_info[0] == 0
+            if fs_info[0] != 0:
+                raise AssertionError(f"ret_code is {fs_info[0]}")
             self.fs_info = fs_info[1]
+        # exact type checks on the inode guards, cheaper than isinstance on the binding class
+        self._inode_type = fsapi.Inode
+        self._handle_type = (
+            getattr(fsapi, self.HANDLE_CLASSES[fs_type]) if fs_type in self.HANDLE_CLASSES else None
+        )
         root_inode = api.LookupRoot(self.fs_info)
         # assert root_inode[0] == 0 # skip for now, not ready
         self.root_inode = root_inode[1]
 
+    # Default input objects, built on first use and shared between calls.
+    # The api only reads them, callers needing other values pass their own.
+    @cached_property
+    def _default_req_flags(self):
+        return self.fsapi.RequestFlags()
+
+    @cached_property
+    def _open_existing_params(self):
+        return self._make_open_params(self.fsapi.OpenDisposition.open_existing)
+
+    @cached_property
+    def _open_existing_read_params(self):
+        return self._make_open_params(
+            self.fsapi.OpenDisposition.open_existing, access_mode=AccessModes.READ
+        )
+
+    @cached_property
+    def _create_new_params(self):
+        return self._make_open_params(self.fsapi.OpenDisposition.create_new)
+
+    @cached_property
+    def _default_extra_info(self):
+        extra_info = self.fsapi.ExtraInfo()
+        apply_typical_extra_info(extra_info)
+        return extra_info
+
+    def _make_open_params(self, open_disposition, access_mode=None):
+        """Returns OpenParameters with full share mode
+        :param OpenDisposition open_disposition: open disposition
+        :param int access_mode: access mode, full access if not provided
+        """
+        open_parameters = self.fsapi.OpenParameters()
+        open_parameters.open_disposition = open_disposition
+        open_parameters.access_mode = access_mode if access_mode is not None else self._FULL_ACCESS
+        open_parameters.share_mode = self._FULL_ACCESS
+        return open_parameters
+
+    def _make_stat_info(self, unix_mode):
+        """Returns a new StatInfo with typical values and the given unix_mode
+        :param int unix_mode: unix mode, including the file type bits
+        """
+        stat_info = self.fsapi.StatInfo()
+        apply_typical_stat(stat_info)
+        stat_info.unix_mode = unix_mode
+        return stat_info
+
     def get_handle_object_type(self):
-        if self.fs_type == "gfs":
-            return self.fsapi.GfsHandle
-        elif self.fs_type == "sofs":
-            return self.fsapi.SofsHandle
-        elif self.fs_type == "fsapi":
-            return self.fsapi.PassthruHandle
+        return self._handle_type
+
+    @staticmethod
+    def _inode_cache_key(file_path):
+        """Returns file_path normalized as used for the inode cache keys"""
+        return "/" + "/".join(split_path(file_path))
+
+    def _cache_get(self, key):
+        """Returns the cached inode for a normalized path, None if not cached"""
+        with self._inode_cache_lock:
+            inode = self._inode_cache.get(key)
+            if inode is not None:
+                self._inode_cache.move_to_end(key)
+        return inode
+
+    def _cache_put(self, key, inode):
+        """Caches the inode of a normalized path"""
+        if not self.cache_inodes:
+            return
+        with self._inode_cache_lock:
+            self._inode_cache[key] = inode
+            self._inode_cache.move_to_end(key)
+            if len(self._inode_cache) > INODE_CACHE_SIZE:
+                self._inode_cache.popitem(last=False)
+
+    def _cache_invalidate(self, file_path):
+        """Drops file_path and everything below it from the inode cache"""
+        if not self._inode_cache:
+            return
+        key = self._inode_cache_key(file_path)
+        prefix = key.rstrip("/") + "/"
+        with self._inode_cache_lock:
+            for cached in [cached for cached in self._inode_cache if cached == key or cached.startswith(prefix)]:
+                del self._inode_cache[cached]
+
+    def _deepest_cached(self, keys, return_attrs=False):
+        """Returns the inode of the deepest cached level of a path and the index
+        of the first level still to look up, (root inode, 0) if nothing is cached.
+        Each Lookup needs its parent inode so the uncached levels can't be
+        resolved in parallel, resuming from the deepest cached one is what saves round-trips
+        :param list keys: normalized path of each level
+        :param bool return_attrs: the last level must be looked up to get its attrs
+        """
+        stop = len(keys) - 1 if return_attrs else len(keys)
+        for index in range(stop, 0, -1):
+            cached = self._cache_get(keys[index - 1])
+            if cached is not None:
+                return cached, index
+        return self.root_inode, 0
+
+    def _queue_close(self, handle):
+        """Closes a handle opened internally, right away unless batch_closes is set,
+        in which case it is queued and the queue flushed once CLOSE_BATCH_SIZE handles are waiting
+        :param Handle handle: file/dir handle
+        """
+        if not self.batch_closes:
+            self.close_file(handle)
+            return
+        self._pending_closes.append(handle)
+        if len(self._pending_closes) >= CLOSE_BATCH_SIZE:
+            self.flush_closes()
+
+    @cached_property
+    def _io_pool(self):
+        # small fixed size on purpose, more threads only add contention on the backend
+        return ThreadPoolExecutor(max_workers=IO_POOL_WORKERS, thread_name_prefix="fsapi-io")
+
+    def flush_closes(self, verify=True):
+        """Closes all the queued handles, in parallel on the io pool
+        :param bool verify: if True, check result
+        Returns the list of Close return codes
+        """
+        handles = list(self._pending_closes)
+        self._pending_closes.clear()
+        if len(handles) < 2:
+            return [self.close_file(handle, verify=verify) for handle in handles]
+        return list(self._io_pool.map(lambda handle: self.close_file(handle, verify=verify), handles))
+
+    def _close_later(self, handle):
+        """Sends the Close of a handle to the io pool if lazy_close is set.
+        Returns True if it was sent, so the caller must not close it
+        """
+        if not self.lazy_close:
+            return False
+        self._lazy_closes.append(self._io_pool.submit(self.close_file, handle, verify=False))
+        return True
+
+    def drain_closes(self, timeout=None):
+        """Waits for the Close calls sent by lazy_close
+        :param float timeout: seconds to wait, forever if None
+        Returns the list of Close return codes, raises if any of them failed or timed out
+        """
+        futures = self._lazy_closes
+        self._lazy_closes = []
+        done, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            self._lazy_closes.extend(futures)
+            raise AssertionError(f"{len(not_done)} handles still closing after {timeout}s")
+        ret_vals = [future.result() for future in futures]
+        failed = [ret_val for ret_val in ret_vals if ret_val != 0]
+        if failed:
+            raise AssertionError(f"Error closing file handles: {failed}")
+        return ret_vals
+
+    def _cached_handle(self, file_path, open_flags):
+        """Returns the cached open handle for file_path and open_flags, None if not cached"""
+        if not self._handle_cache:
+            return None
+        key = (file_path, open_flags)
+        handle = self._handle_cache.get(key)
+        if handle is not None:
+            self._handle_cache.move_to_end(key)
+        return handle
+
+    def _store_handle(self, file_path, open_flags, handle):
+        """Caches an open handle if cache_handles is set, the oldest one is closed when full.
+        Returns True if the handle was cached, so the caller must not close it
+        """
+        if not self.cache_handles or not handle:
+            return False
+        self._handle_cache[(file_path, open_flags)] = handle
+        if len(self._handle_cache) > HANDLE_CACHE_SIZE:
+            self.close_file(self._handle_cache.popitem(last=False)[1])
+        return True
+
+    def _drop_handles(self, file_path):
+        """Closes the cached handles of file_path and everything below it,
+        after sending the writes queued for them"""
+        if self._pending_writes:
+            prefix = file_path.rstrip("/") + "/"
+            for path in [path for path in self._pending_writes if path == file_path or path.startswith(prefix)]:
+                self.flush_writes(path, verify=False)
+        if not self._handle_cache:
+            return
+        prefix = file_path.rstrip("/") + "/"
+        for key in [key for key in self._handle_cache if key[0] == file_path or key[0].startswith(prefix)]:
+            self.close_file(self._handle_cache.pop(key), verify=False)
+
+    def _stash_attrs(self, file_path, target_attr):
+        """Keeps the post-op attrs of file_path for get_attr when attr_ttl is set,
+        anything cached for the path is dropped if they weren't returned
+        :param str file_path: path of the file/dir
+        :param PrePostAttributes target_attr: attrs returned by the operation
+        """
+        if not self.attr_ttl:
+            return
+        both = AttributeFlags.STAT_POST_OP | AttributeFlags.EXTRA_POST_OP
+        if target_attr and (target_attr.flags & both) == both:
+            self._attr_cache[file_path] = (
+                (target_attr.stat_post_op, target_attr.extra_post_op), time.monotonic()
+            )
+        else:
+            self._attr_cache.pop(file_path, None)
+
+    def _drop_attrs(self, *file_paths):
+        """Drops the cached attrs and xattrs of file_paths and everything below them"""
+        for cache in (self._attr_cache, self._xattr_cache):
+            if not cache:
+                continue
+            for file_path in file_paths:
+                prefix = file_path.rstrip("/") + "/"
+                # list() snapshots the keys in one step, the batch ops may stash attrs meanwhile
+                for key in [key for key in list(cache) if key == file_path or key.startswith(prefix)]:
+                    cache.pop(key, None)
+
+    def _drop_all_attrs(self):
+        """Drops all the cached attrs, for operations done on a handle or inode
+        whose path isn't known"""
+        if self._attr_cache:
+            self._attr_cache.clear()
+
+    def write_buffered(self, data, file_path, offset):
+        """Queues data to be written at offset, contiguous writes to the same file are
+        sent together in a single WriteV once WRITE_COALESCE_COUNT buffers or
+        WRITE_COALESCE_BYTES are queued, a write that isn't contiguous flushes the queue first.
+        Queued data isn't visible to the backend until flushed, see flush_writes
+        :param bytes data: buffer to write
+        :param str file_path: path of the file
+        :param int offset: starting point to write
+        Returns the write_v result if the queue was flushed, None otherwise
+        """
+        ret_val = None
+        pending = self._pending_writes.get(file_path)
+        if pending and pending[0] + pending[2] != offset:
+            ret_val = self.flush_writes(file_path)[0]
+            pending = None
+        if not pending:
+            pending = self._pending_writes[file_path] = [offset, [], 0]
+        pending[1].append(data)
+        pending[2] += len(data)
+        if len(pending[1]) >= WRITE_COALESCE_COUNT or pending[2] >= WRITE_COALESCE_BYTES:
+            ret_val = self.flush_writes(file_path)[0]
+        return ret_val
+
+    def flush_writes(self, file_path=None, verify=True):
+        """Sends the writes queued by write_buffered
+        :param str file_path: only flush the writes of this file, all of them if None
+        :param bool verify: if True, check result
+        Returns the list of write_v results
+        """
+        if file_path is None:
+            file_paths = list(self._pending_writes)
+        else:
+            file_paths = [file_path] if file_path in self._pending_writes else []
+        ret_vals = []
+        for path in file_paths:
+            offset, buffers, _ = self._pending_writes.pop(path)
+            ret_vals.append(self.write_v(buffers, file_path=path, offset=offset, verify=verify))
+        return ret_vals
+
+    def flush_handles(self, verify=True):
+        """Closes all the cached handles, the queued writes are sent first
+        :param bool verify: if True, check result
+        Returns the list of Close return codes
+        """
+        self.flush_writes(verify=verify)
+        ret_vals = []
+        while self._handle_cache:
+            ret_vals.append(self.close_file(self._handle_cache.popitem(last=False)[1], verify=verify))
+        return ret_vals
+
+    def close(self):
+        """Closes the cached and queued handles and shuts down the io pool"""
+        self.flush_handles()
+        self.flush_closes()
+        self.drain_closes()
+        io_pool = self.__dict__.pop("_io_pool", None)
+        if io_pool:
+            io_pool.shutdown()
+
+    def __del__(self):
+        # handles still cached or queued are closed when the filesystem object goes away,
+        # one by one as the io pool may not accept work anymore at interpreter exit.
+        # Queued writes are only sent by an explicit flush_writes/close, sending them from
+        # whatever thread the gc runs on (or after the bindings are torn down) isn't safe
+        pending_writes = getattr(self, "_pending_writes", None)
+        if pending_writes:
+            log.warning(
+                "FileSystem dropped without flush_writes/close, queued writes not sent for: %s",
+                sorted(pending_writes),
+            )
+            pending_writes.clear()
+        if getattr(self, "_handle_cache", None):
+            self.flush_handles(verify=False)
+        while getattr(self, "_pending_closes", None):
+            self.close_file(self._pending_closes.popleft(), verify=False)
 
     def lookup(
             self,
@@ -69,12 +449,12 @@ class FileSystem:
             verify=True,
     ):
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         ret_code, root_inode, parent_attr, target_attr = self.api.Lookup(
             self.fs_info, parent_inode, file_path, req_flags
         )
-        if verify:
-            assert ret_code == 0, f"Unable to get inode for {file_path}"
+        if verify and ret_code != 0:
+            raise AssertionError(f"Unable to get inode for {file_path}")
         return ret_code, parent_attr, target_attr, root_inode
 
     def get_inode(
@@ -88,29 +468,31 @@ class FileSystem:
         :param bool return_attrs: if True, it will return
             pre_attr and post_attr
         """
-        if not file_path.startswith("/"):
-            file_path = "/" + file_path
-        levels = []
-        parent = os.path.split(file_path)[0]
-        if os.path.split(file_path)[1] != "":
-            levels.insert(0, os.path.split(file_path)[1])
-        while parent != "/":
-            levels.insert(0, parent.split("/")[-1])
-            parent = os.path.split(parent)[0]
-
-        if len(levels) == 0:
+        levels = split_path(file_path)
+        if not levels:
             return self.root_inode
-        root_inode = self.root_inode
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
-        for level in levels:
+            req_flags = self._default_req_flags
+        keys = None
+        root_inode, start = self.root_inode, 0
+        if self.cache_inodes:
+            keys = list(accumulate(levels, lambda key, level: f"{key}/{level}", initial=""))[1:]
+            root_inode, start = self._deepest_cached(keys, return_attrs)
+        last = len(levels) - 1
+        for index in range(start, len(levels)):
+            # only the attrs of the last level are returned, don't request them for the others
             ret_code, parent_attr, target_attr, root_inode = self.lookup(
-                level, root_inode, req_flags, verify=False
+                levels[index],
+                root_inode,
+                req_flags if index == last else self._default_req_flags,
+                verify=False,
             )
-            if verify:
-                assert ret_code == 0, f"Unable to get inode for {file_path}"
             if ret_code != 0:
+                if verify:
+                    raise AssertionError(f"Unable to get inode for {file_path}")
                 return ret_code
+            if keys:
+                self._cache_put(keys[index], root_inode)
         return (
             root_inode
             if not return_attrs
@@ -120,7 +502,8 @@ class FileSystem:
     def lookup_root(self):
         """Returns root inode"""
         root_inode = self.api.LookupRoot(self.fs_info)
-        assert root_inode[0] == 0
+        if root_inode[0] != 0:
+            raise AssertionError(f"ret_code is {root_inode[0]}")
         return root_inode[1]
 
     def sync(
@@ -136,33 +519,29 @@ class FileSystem:
             all flags will be disabled if not provided
         :param bool verify: if True, check ret_code==0
         """
-        autoclose = False
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
+        # sync is a barrier, queued closes go out first
+        self.flush_closes()
         if not handle_id:
             inode = self.get_inode(file_path, verify=False)
-            if not isinstance(inode, self.fsapi.Inode):
+            if type(inode) is not self._inode_type:
                 return inode, None, None
-            open_parameters = self.fsapi.OpenParameters()
-            open_parameters.open_disposition = self.fsapi.OpenDisposition.open_existing
-            open_parameters.access_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-            open_parameters.share_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-            ret_code, handle_id, target_attr = self.api.Open(
-                self.fs_info,
+            ret_code, target_attr = self._open_op_close(
                 inode,
-                req_flags=self.fsapi.RequestFlags(),
-                open_flags=os.O_RDONLY,
-                open_parameters=open_parameters
+                os.O_RDONLY,
+                lambda handle: self.api.Sync(self.fs_info, handle, req_flags=req_flags),
             )
-            autoclose = True
-        # Call Sync
-        ret_code, target_attr = self.api.Sync(
-            self.fs_info, handle_id, req_flags=req_flags
-        )
-        if handle_id and autoclose:
-            self.close_file(handle_id)
-        if verify:
-            assert ret_code == 0
+        else:
+            ret_code, target_attr = self.api.Sync(
+                self.fs_info, handle_id, req_flags=req_flags
+            )
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
+        if file_path:
+            self._stash_attrs(file_path, target_attr)
+        else:
+            self._drop_all_attrs()
         return ret_code, None, target_attr
 
     def hole_punch(
@@ -182,29 +561,21 @@ class FileSystem:
         :param bool verify: if True, check ret_code==0
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
 
         inode = self.get_inode(file_path, verify=False)
-        if not isinstance(inode, self.fsapi.Inode):
+        if type(inode) is not self._inode_type:
             return inode, None, None
-        open_parameters = self.fsapi.OpenParameters()
-        open_parameters.open_disposition = self.fsapi.OpenDisposition.open_existing
-        open_parameters.access_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-        open_parameters.share_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-        ret_code, handle, target_attr = self.api.Open(
-            self.fs_info,
+        ret_code, target_attr = self._open_op_close(
             inode,
-            req_flags=self.fsapi.RequestFlags(),
-            open_flags=os.O_WRONLY,
-            open_parameters=open_parameters
-        )
-        # Call HolePunch
-        ret_code, target_attr = self.api.HolePunch(
-            self.fs_info, handle, req_flags=req_flags, offset=offset, len=length
+            os.O_WRONLY,
+            lambda handle: self.api.HolePunch(
+                self.fs_info, handle, req_flags=req_flags, offset=offset, len=length
+            ),
         )
-        if verify:
-            assert ret_code == 0
-        self.close_file(handle)
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
+        self._stash_attrs(file_path, target_attr)
         return ret_code, None, target_attr
 
     def find_sparse_region(
@@ -223,29 +594,42 @@ class FileSystem:
         :param bool verify: if True, check ret_code==0
         """
         inode = self.get_inode(file_path, verify=False)
-        if not isinstance(inode, self.fsapi.Inode):
+        if type(inode) is not self._inode_type:
             return inode, None, None
-        open_parameters = self.fsapi.OpenParameters()
-        open_parameters.open_disposition = self.fsapi.OpenDisposition.open_existing
-        open_parameters.access_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-        open_parameters.share_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-        ret_code, handle, target_attr = self.api.Open(
-            self.fs_info,
-            inode,
-            req_flags=self.fsapi.RequestFlags(),
-            open_flags=os.O_RDONLY,
-            open_parameters=open_parameters
-        )
         seek_type = self.fsapi.SeekType(seek_type)
-        # Call FindSparseRegion
-        ret_code, match_offset = self.api.FindSparseRegion(
-            self.fs_info, handle, offset=offset, seek_type=seek_type
+        # the handle is opened read only, so only read access is requested
+        ret_code, match_offset = self._open_op_close(
+            inode,
+            os.O_RDONLY,
+            lambda handle: self.api.FindSparseRegion(
+                self.fs_info, handle, offset=offset, seek_type=seek_type
+            ),
+            open_parameters=self._open_existing_read_params,
         )
-        if verify:
-            assert ret_code == 0
-        self.close_file(handle)
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, match_offset
 
+    def _open_op_close(self, inode, open_flags, operation, open_parameters=None):
+        """Opens inode, runs operation on the handle and closes it, also if operation fails
+        :param Inode inode: inode to open
+        :param int open_flags: open_flags
+        :param callable operation: called with the open handle, its result is returned
+        :param OpenParameters open_parameters: defaults to open existing with full access
+        """
+        ret_code, handle, _ = self.api.Open(
+            self.fs_info,
+            inode,
+            req_flags=self._default_req_flags,
+            open_flags=open_flags,
+            open_parameters=open_parameters or self._open_existing_params,
+        )
+        try:
+            return operation(handle)
+        finally:
+            if handle:
+                self._queue_close(handle)
+
     def open_dir(
             self,
             dir_path,
@@ -262,19 +646,16 @@ class FileSystem:
         :param bool verify: if True, check ret_code==0
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         if not open_parameters:
-            open_parameters = self.fsapi.OpenParameters()
-            open_parameters.open_disposition = self.fsapi.OpenDisposition.open_existing
-            open_parameters.access_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-            open_parameters.share_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
+            open_parameters = self._open_existing_params
         dir_inode = self.get_inode(dir_path)
 
         ret_code, handle, target_attr = self.api.Open(
             self.fs_info, dir_inode, req_flags=req_flags, open_flags=open_flags, open_parameters=open_parameters
         )
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, None, target_attr, handle
 
     def upgrade_open(
@@ -293,17 +674,14 @@ class FileSystem:
         :param bool verify: if True, check ret_code==0
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         if not open_parameters:
-            open_parameters = self.fsapi.OpenParameters()
-            open_parameters.open_disposition = self.fsapi.OpenDisposition.open_existing
-            open_parameters.access_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-            open_parameters.share_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
+            open_parameters = self._open_existing_params
         ret_code, target_attr = self.api.UpgradeOpen(
             self.fs_info, handle, req_flags, open_flags, open_parameters
         )
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, None, target_attr
 
     def downgrade_open(
@@ -322,8 +700,8 @@ class FileSystem:
         ret_code = self.api.DowngradeOpen(
             self.fs_info, handle, access_mode, shared_mode
         )
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code
 
     def get_parent_objectNumber(self, object_path, verify=True):
@@ -332,8 +710,8 @@ class FileSystem:
         ret_code, parent_id = self.api.GetParentObjectNumber(
             self.fs_info, inode
         )
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, parent_id
 
     def mkdir(
@@ -354,25 +732,18 @@ class FileSystem:
             all flags will be disabled if not provided
         :param bool verify: if True, check result
         """
-        folder_name = os.path.split(folder_path)[1]
-        parent_folder = os.path.split(folder_path)[0]
+        parent_folder, folder_name = os.path.split(folder_path)
         if not extra_info:
-            extra_info = self.fsapi.ExtraInfo()
-            for key, val in EXTRA_INFO_TYPICAL_VALUES.items():
-                extra_info.__setattr__(key, val)
+            extra_info = self._default_extra_info
         if not stat_info:
-            stat_info = self.fsapi.StatInfo()
-            for key, val in STAT_TYPICAL_VALUES.items():
-                stat_info.__setattr__(key, val)
-            stat_info.unix_mode = unix_mode if unix_mode else 0o755
-            stat_info.unix_mode |= stat.S_IFDIR
+            stat_info = self._make_stat_info((unix_mode if unix_mode else 0o755) | S_IFDIR)
         try:
             parent_inode = self.get_inode(parent_folder)
         except AssertionError as e:
             return [-1, f"parent folder does not exist: {e}"]
             # if no flag object is passed, all flags are active by default
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
 
         ret_code, inode, parent_attr, target_attr = self.api.MkDir(
             self.fs_info,
@@ -382,8 +753,10 @@ class FileSystem:
             extra_info,
             req_flags,
         )
-        if verify:
-            assert ret_code == 0
+        # the parent's times and link count changed
+        self._drop_attrs(parent_folder)
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, parent_attr, target_attr, inode
 
     def close_dir(self, dir_handle, req_flags=None, verify=True):
@@ -394,10 +767,10 @@ class FileSystem:
         :param bool verify: if True, check result
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         ret_val = self.api.Close(self.fs_info, dir_handle, req_flags)
-        if verify:
-            assert ret_val == 0
+        if verify and ret_val != 0:
+            raise AssertionError(f"ret_code is {ret_val}")
         return ret_val
 
     def read_dir_entries(
@@ -406,6 +779,7 @@ class FileSystem:
             req_flags=None,
             cookie=0,
             max_entries=MAX_READDIR_ENTRIES,
+            as_dict=True,
     ):
         """Read dir on dir_path
         :param str dir_path: dir path
@@ -413,29 +787,65 @@ class FileSystem:
         :param int max_entries: max number of returned entries
         :param RequestFlags req_flags: flags to request post/pre attributes
             all flags will be disabled if not provided
+        :param bool as_dict: if True entries are returned as a {name: entry} dict,
+            otherwise as a (names, entries) tuple of lists
         Returns True if everything executes correctly, error otherwise
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         # Get dir handle by path
         ret_code, _, _, dir_handle = self.open_dir(
             dir_path, verify=False, open_flags=os.O_DIRECTORY | os.O_RDONLY
         )
-        if not isinstance(dir_handle, self.get_handle_object_type()):
-            return ret_code, None, None, {}
+        if not isinstance(dir_handle, self._handle_type):
+            return ret_code, None, None, {} if as_dict else ([], [])
         ret_code, dir_entries, names, target_attr = self.api.ReadDirEntries(
             self.fs_info, dir_handle, cookie, max_entries, req_flags
         )
+        self._queue_close(dir_handle)
         if ret_code != 0:
-            self.close_dir(dir_handle)
-            return ret_code, None, None, {}
-        self.close_dir(dir_handle)
-        dict_entries = {}
-        if dir_entries:
-            for entry, name in zip(dir_entries, names):
-                dict_entries[name] = entry
+            return ret_code, None, None, {} if as_dict else ([], [])
+        if not as_dict:
+            return ret_code, None, target_attr, (names or [], dir_entries or [])
+        dict_entries = dict(zip(names, dir_entries)) if dir_entries else {}
         return ret_code, None, target_attr, dict_entries
 
+    def iter_dir_entries(
+            self,
+            dir_path,
+            req_flags=None,
+            batch=MAX_READDIR_ENTRIES,
+    ):
+        """Yields (name, entry) for every entry of dir_path, the dir is opened once
+        and read in batches of batch entries until it is exhausted
+        :param str dir_path: dir path
+        :param RequestFlags req_flags: flags to request post/pre attributes
+            all flags will be disabled if not provided
+        :param int batch: max number of entries requested per ReadDirEntries call
+        """
+        if not req_flags:
+            req_flags = self._default_req_flags
+        ret_code, _, _, dir_handle = self.open_dir(
+            dir_path, verify=False, open_flags=os.O_DIRECTORY | os.O_RDONLY
+        )
+        if not isinstance(dir_handle, self._handle_type):
+            return
+        try:
+            # the cookie is the index of the first entry to return
+            cookie = 0
+            while True:
+                ret_code, dir_entries, names, _ = self.api.ReadDirEntries(
+                    self.fs_info, dir_handle, cookie, batch, req_flags
+                )
+                if ret_code != 0 or not dir_entries:
+                    return
+                yield from zip(names, dir_entries)
+                if len(dir_entries) < batch:
+                    return
+                cookie += len(dir_entries)
+        finally:
+            self.close_dir(dir_handle)
+
     def create_file(
             self,
             file_path,
@@ -461,35 +871,25 @@ class FileSystem:
         if everything ok, error otherwise
         """
         if not open_parameters:
-            open_parameters = self.fsapi.OpenParameters()
-            open_parameters.open_disposition = self.fsapi.OpenDisposition.create_new
-            open_parameters.access_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-            open_parameters.share_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
+            open_parameters = self._create_new_params
 
-        folder_inode = self.get_inode(
-            os.path.split(file_path)[0], verify=verify
-        )
-        if not isinstance(folder_inode, self.fsapi.Inode):
+        parent_folder, file_name = os.path.split(file_path)
+        folder_inode = self.get_inode(parent_folder, verify=verify)
+        if type(folder_inode) is not self._inode_type:
             return folder_inode
         if not stat_info:
-            stat_info = self.fsapi.StatInfo()
-            for key, val in STAT_TYPICAL_VALUES.items():
-                stat_info.__setattr__(key, val)
-            stat_info.unix_mode = unix_mode if unix_mode else 0o755
-            stat_info.unix_mode |= stat.S_IFREG
+            stat_info = self._make_stat_info((unix_mode if unix_mode else 0o755) | S_IFREG)
         if not extra_info:
-            extra_info = self.fsapi.ExtraInfo()
-            for key, val in EXTRA_INFO_TYPICAL_VALUES.items():
-                extra_info.__setattr__(key, val)
+            extra_info = self._default_extra_info
 
         # if no flag object is passed, all flags are active by default
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
 
         ret_code, inode, handle, parent_attr, target_attr = self.api.Create(
             self.fs_info,
             folder_inode,
-            os.path.split(file_path)[1],
+            file_name,
             stat_info,
             extra_info,
             req_flags=req_flags,
@@ -497,9 +897,11 @@ class FileSystem:
             open_parameters=open_parameters
         )
         if handle and autoclose:
-            self.close_file(handle)
-        if verify:
-            assert ret_code == 0
+            self._queue_close(handle)
+        self._drop_attrs(parent_folder)
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
+        self._stash_attrs(file_path, target_attr)
         return ret_code, parent_attr, target_attr, inode, handle
 
     def create_stream(
@@ -517,17 +919,19 @@ class FileSystem:
         :param bool verify: if True, check result
         Returns return code and stream id
         """
-        if not isinstance(inode, self.fsapi.Inode):
+        if type(inode) is not self._inode_type:
             return False
         # if no flag object is passed, no flags are requested by default
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
 
         ret_code, stream_id, base_attr = self.api.CreateStream(
             self.fs_info, inode, name, req_flags
         )
-        if verify:
-            assert ret_code == 0
+        # the attrs of the base inode changed, its path isn't known
+        self._drop_all_attrs()
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, None, base_attr, stream_id
 
     def open_stream(
@@ -550,31 +954,30 @@ class FileSystem:
         Returns the stream id and handler if it is open correctly, error otherwise
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         if not open_parameters:
-            open_parameters = self.fsapi.OpenParameters()
-            open_parameters.open_disposition = self.fsapi.OpenDisposition.open_existing
-            open_parameters.access_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-            open_parameters.share_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-        if not isinstance(inode, self.fsapi.Inode):
+            open_parameters = self._open_existing_params
+        if type(inode) is not self._inode_type:
             return False
 
         if stream_id and name:
             raise AssertionError("either name or id must be provided, not both")
 
         if not name:
-            assert stream_id, f"Error, either name or id must be provided"
+            if not stream_id:
+                raise AssertionError("Error, either name or id must be provided")
             ret_code, handle, base_attr = self.api.OpenStreamById(
                 self.fs_info, inode, stream_id, req_flags, open_flags, open_parameters=open_parameters
             )
         elif not stream_id:
-            assert name, f"Error, either name or id must be provided"
+            if not name:
+                raise AssertionError("Error, either name or id must be provided")
             ret_code, stream_id, handle, base_attr = self.api.OpenStreamByName(
                 self.fs_info, inode, name, req_flags, open_flags, open_parameters=open_parameters
             )
 
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, None, base_attr, stream_id, handle
 
     def delete_stream(
@@ -592,15 +995,16 @@ class FileSystem:
         Returns 0 if delete is ok, error otherwise
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
-        if not isinstance(inode, self.fsapi.Inode):
+            req_flags = self._default_req_flags
+        if type(inode) is not self._inode_type:
             return False
 
         ret_code, base_attr = self.api.DeleteStream(
             self.fs_info, inode, name, req_flags
         )
-        if verify:
-            assert ret_code == 0
+        self._drop_all_attrs()
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, None, base_attr
 
     def list_streams(
@@ -618,8 +1022,8 @@ class FileSystem:
             stream_entries,
             stream_names,
         ) = self.api.ListStreams(self.fs_info, inode, resume_id, buffer_size)
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, stream_entries, stream_names
 
     def rename_stream(
@@ -639,15 +1043,16 @@ class FileSystem:
         Returns 0 if rename is ok, error otherwise
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
-        if not isinstance(inode, self.fsapi.Inode):
+            req_flags = self._default_req_flags
+        if type(inode) is not self._inode_type:
             return False
 
         ret_code, base_attr = self.api.RenameStream(
             self.fs_info, inode, name_from, name_to, req_flags
         )
-        if verify:
-            assert ret_code == 0
+        self._drop_all_attrs()
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, None, base_attr
 
     def get_stream_length(
@@ -662,14 +1067,14 @@ class FileSystem:
         Returns 0 if call is ok, as well as the length and bytes_used,
         error otherwise
         """
-        if not isinstance(inode, self.fsapi.Inode):
+        if type(inode) is not self._inode_type:
             return False
 
         ret_code, length, bytes_used = self.api.GetStreamLength(
             self.fs_info, inode, stream_id
         )
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, length, bytes_used
 
     def set_stream_length(
@@ -686,16 +1091,43 @@ class FileSystem:
         Returns 0 if call is ok, as well as the length and bytes_used,
         error otherwise
         """
-        if not isinstance(inode, self.fsapi.Inode):
+        if type(inode) is not self._inode_type:
             return False
 
         ret_code = self.api.SetStreamLength(
             self.fs_info, inode, stream_id, new_length
         )[0]
-        if verify:
-            assert ret_code == 0
+        self._drop_all_attrs()
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code
 
+    def get_stream_length_by_path(self, file_path, stream_id, verify=True):
+        """Gets the stream length for the file/dir at file_path and stream_id,
+        replaces the get_inode + get_stream_length two-step in callers
+        :param str file_path: path of the file/dir associated with the stream
+        :param int stream_id: id of the stream to get length from
+        Returns 0 if call is ok, as well as the length and bytes_used,
+        error otherwise
+        """
+        inode = self.get_inode(file_path, verify=verify)
+        if type(inode) is not self._inode_type:
+            return inode, None, None
+        return self.get_stream_length(inode, stream_id, verify=verify)
+
+    def set_stream_length_by_path(self, file_path, stream_id, new_length, verify=True):
+        """Sets the stream length for the file/dir at file_path and stream_id to new_length,
+        replaces the get_inode + set_stream_length two-step in callers
+        :param str file_path: path of the file/dir associated with the stream
+        :param int stream_id: id of the stream to set length
+        :param int new_length: new length to set
+        Returns 0 if call is ok, error otherwise
+        """
+        inode = self.get_inode(file_path, verify=verify)
+        if type(inode) is not self._inode_type:
+            return inode
+        return self.set_stream_length(inode, stream_id, new_length, verify=verify)
+
     def write(
             self,
             data,
@@ -720,23 +1152,16 @@ class FileSystem:
         """
         autoclose = False
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         if not handle_id:
-            autoclose = True
-            assert file_path, "Either file_path or handle_id must be provided"
-            file_inode = self.get_inode(file_path, verify=False)
-            if not isinstance(file_inode, self.fsapi.Inode):
-                if file_inode == errno.ENOENT:
-                    print(
-                        f"file does not exist: {file_path}, it will be created"
-                    )
-                    handle_id = self.create_file(file_path)[-1]
-                else:
-                    return file_inode
-            else:
-                handle_id = self.open_file(file_path, open_flags=os.O_WRONLY)[
-                    -1
-                ]
+            if not file_path:
+                raise AssertionError("Either file_path or handle_id must be provided")
+            handle_id = self._cached_handle(file_path, os.O_WRONLY)
+        if not handle_id:
+            error, handle_id = self._open_or_create(file_path, os.O_WRONLY)
+            if error is not None:
+                return error
+            autoclose = not self._store_handle(file_path, os.O_WRONLY, handle_id)
         num_bytes = len(data)
 
         ret_code, target_attr = self.api.Write(
@@ -749,11 +1174,16 @@ class FileSystem:
             write_flags=write_flags,
         )
         # Close write handle
-        if autoclose:
+        if autoclose and not self._close_later(handle_id):
             close_code = self.close_file(handle_id)
-            assert close_code == 0, f"Error closing file handle: {close_code}"
-        if verify:
-            assert ret_code == 0
+            if close_code != 0:
+                raise AssertionError(f"Error closing file handle: {close_code}")
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
+        if file_path:
+            self._stash_attrs(file_path, target_attr)
+        else:
+            self._drop_all_attrs()
         return ret_code, None, target_attr
 
     def write_v(
@@ -780,38 +1210,63 @@ class FileSystem:
         """
         autoclose = False
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         if not handle_id:
-            autoclose = True
-            assert file_path, "Either file_path or handle_id must be provided"
-            file_inode = self.get_inode(file_path, verify=False)
-            if not isinstance(file_inode, self.fsapi.Inode):
-                if file_inode == errno.ENOENT:
-                    print(
-                        f"file does not exist: {file_path}, it will be created"
-                    )
-                    handle_id = self.create_file(file_path)[-1]
-                else:
-                    return file_inode
-            else:
-                handle_id = self.open_file(file_path, open_flags=os.O_WRONLY)[
-                    -1
-                ]
-
-        ret_code, target_attr = self.api.WriteV(
-            self.fs_info,
-            handle_id,
-            req_flags=req_flags,
-            offset=offset,
-            iov=data_list,
-            write_flags=write_flags,
-        )
+            if not file_path:
+                raise AssertionError("Either file_path or handle_id must be provided")
+            handle_id = self._cached_handle(file_path, os.O_WRONLY)
+        if not handle_id:
+            error, handle_id = self._open_or_create(file_path, os.O_WRONLY)
+            if error is not None:
+                return error
+            autoclose = not self._store_handle(file_path, os.O_WRONLY, handle_id)
+
+        if autoclose and not self.lazy_close and hasattr(self.api, "WriteVClose"):
+            # the write and the close of the handle go in a single chained request
+            ret_code, target_attr, close_code = self.api.WriteVClose(
+                self.fs_info,
+                handle_id,
+                req_flags=req_flags,
+                offset=offset,
+                iov=data_list,
+                write_flags=write_flags,
+            )
+            if close_code != 0:
+                raise AssertionError(f"Error closing file handle: {close_code}")
+            autoclose = False
+        elif hasattr(self.api, "WriteV"):
+            # all the buffers go in a single vectored request
+            ret_code, target_attr = self.api.WriteV(
+                self.fs_info,
+                handle_id,
+                req_flags=req_flags,
+                offset=offset,
+                iov=data_list,
+                write_flags=write_flags,
+            )
+        else:
+            # no vectored write in this api, join the buffers (str or bytes) into a single Write
+            data = data_list[0][:0].join(data_list) if data_list else b""
+            ret_code, target_attr = self.api.Write(
+                self.fs_info,
+                handle_id,
+                req_flags=req_flags,
+                offset=offset,
+                length=len(data),
+                buffer=data,
+                write_flags=write_flags,
+            )
         # Close write handle
-        if autoclose:
+        if autoclose and not self._close_later(handle_id):
             close_code = self.close_file(handle_id)
-            assert close_code == 0, f"Error closing file handle: {close_code}"
-        if verify:
-            assert ret_code == 0
+            if close_code != 0:
+                raise AssertionError(f"Error closing file handle: {close_code}")
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
+        if file_path:
+            self._stash_attrs(file_path, target_attr)
+        else:
+            self._drop_all_attrs()
         return ret_code, None, target_attr
 
     def read(
@@ -836,20 +1291,28 @@ class FileSystem:
         :param bool verify: if True, check result
         Returns the content (bytes) read on read operation
         """
+        # nothing to read, skip the lookup/open/read/close round-trips
+        if length == 0:
+            return 0, None, None, b""
         autoclose = False
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
+        if not handle_id:
+            if not file_path:
+                raise AssertionError("either file_path or handle must be provided")
+            if file_path in self._pending_writes:
+                self.flush_writes(file_path)
+            handle_id = self._cached_handle(file_path, os.O_RDONLY)
         if not handle_id:
-            autoclose = True
-            assert file_path, f"either file_path or handle must be provided"
             file_inode = self.get_inode(file_path, verify=False)
-            if not isinstance(file_inode, self.fsapi.Inode):
+            if type(file_inode) is not self._inode_type:
                 print(f"Error reading file:{file_path}: {file_inode}")
                 return file_inode
             else:
                 handle_id = self.open_file(file_path, open_flags=os.O_RDONLY)[
                     -1
                 ]
+            autoclose = not self._store_handle(file_path, os.O_RDONLY, handle_id)
 
         ret_code, read_result, target_attr = self.api.Read(
             self.fs_info,
@@ -860,14 +1323,94 @@ class FileSystem:
             read_flags=read_flags,
         )
         # Close read handle
-        if autoclose:
+        if autoclose and not self._close_later(handle_id):
             close_code = self.close_file(handle_id)
-            assert close_code == 0, f"Error closing file handle: {close_code}"
+            if close_code != 0:
+                raise AssertionError(f"Error closing file handle: {close_code}")
 
-        if verify:
-            assert ret_code == length
+        if verify and ret_code != length:
+            raise AssertionError(f"ret_code is {ret_code}, expected {length}")
         return ret_code, None, target_attr, read_result
 
+    def write_batch(self, ops, req_flags=None, write_flags=0, verify=True):
+        """Writes several buffers, each file is opened once and the files are written concurrently,
+        files that don't exist are created as write does
+        :param list ops: list of (file_path, data, offset)
+        :param RequestFlag req_flags: flags to request post/pre attributes
+            all flags will be disabled if not provided
+        :param int write_flags: write flags, default to no-cache
+        :param bool verify: if True, check result
+        Returns the list of write results, in the order of ops
+        """
+        results = self._run_batch(
+            ops,
+            os.O_WRONLY,
+            create=True,
+            operation=lambda handle, data, offset: self.write(
+                data, handle_id=handle, req_flags=req_flags, offset=offset,
+                write_flags=write_flags, verify=False,
+            ),
+        )
+        if verify:
+            failed = [result[0] for result in results if result[0] != 0]
+            if failed:
+                raise AssertionError(f"{len(failed)} writes failed, ret_codes: {failed}")
+        return results
+
+    def read_batch(self, ops, req_flags=None, read_flags=0, verify=True):
+        """Reads several ranges, each file is opened once and the files are read concurrently
+        :param list ops: list of (file_path, length, offset)
+        :param RequestFlag req_flags: flags to request post/pre attributes
+            all flags will be disabled if not provided
+        :param int read_flags: read flags, default to 0
+        :param bool verify: if True, check result
+        Returns the list of read results, in the order of ops
+        """
+        results = self._run_batch(
+            ops,
+            os.O_RDONLY,
+            operation=lambda handle, length, offset: self.read(
+                length, handle_id=handle, req_flags=req_flags, offset=offset,
+                read_flags=read_flags, verify=False,
+            ),
+        )
+        if verify:
+            for (file_path, length, _), result in zip(ops, results):
+                if result[0] != length:
+                    raise AssertionError(f"read of {file_path} returned {result[0]}, expected {length}")
+        return results
+
+    def _run_batch(self, ops, open_flags, operation, create=False):
+        """Groups ops by path and runs each group on the io pool with a single open handle
+        :param list ops: list of (file_path, arg, offset)
+        :param int open_flags: OS flags for file open
+        :param callable operation: called with (handle, arg, offset)
+        :param bool create: create the files that don't exist, otherwise opening them asserts
+        Returns the operation results, in the order of ops
+        """
+        by_path = {}
+        for index, (file_path, arg, offset) in enumerate(ops):
+            by_path.setdefault(file_path, []).append((index, arg, offset))
+
+        def run_path(file_path, path_ops):
+            if create:
+                error, handle = self._open_or_create(file_path, open_flags)
+                if error is not None:
+                    raise AssertionError(f"Unable to open {file_path}: {error}")
+            else:
+                handle = self.open_file(file_path, open_flags=open_flags)[-1]
+            try:
+                return [(index, operation(handle, arg, offset)) for index, arg, offset in path_ops]
+            finally:
+                self.close_file(handle)
+
+        results = [None] * len(ops)
+        futures = [self._io_pool.submit(run_path, path, path_ops) for path, path_ops in by_path.items()]
+        for future in as_completed(futures):
+            for index, result in future.result():
+                results[index] = result
+        return results
+
     def close_file(self, file_handle, req_flags=None, verify=True):
         """Closes file_handle
         :param fsapi.GfsHandle file_handle: file handler
@@ -876,10 +1419,10 @@ class FileSystem:
         :param bool verify: if True, check result
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         ret_val = self.api.Close(self.fs_info, file_handle, req_flags)
-        if verify:
-            assert ret_val == 0
+        if verify and ret_val != 0:
+            raise AssertionError(f"ret_code is {ret_val}")
         return ret_val
 
     def open_file(
@@ -898,29 +1441,50 @@ class FileSystem:
         :param int open_parameters: Shared access mode parameters
         Returns the file_handle if it is open correctly, error otherwise
         """
-        if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
-        if not open_parameters:
-            open_parameters = self.fsapi.OpenParameters()
-            open_parameters.open_disposition = self.fsapi.OpenDisposition.open_existing
-            open_parameters.access_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
-            open_parameters.share_mode = AccessModes.READ | AccessModes.WRITE | AccessModes.DELETE
         file_inode = self.get_inode(file_path)
-        parent_inode = self.get_inode(os.path.split(file_path)[0])
-        if not isinstance(file_inode, self.fsapi.Inode):
+        if type(file_inode) is not self._inode_type:
             return file_inode
+        return self._open_inode(file_path, file_inode, open_flags, open_parameters, req_flags, verify)
+
+    def _open_or_create(self, file_path, open_flags):
+        """Opens file_path for write/write_v, creating it if it doesn't exist.
+        The lookup done to know if it exists is reused for the Open
+        :param str file_path: path of the file
+        :param int open_flags: OS flags for file open
+        Returns (None, handle) if ok, (error, None) if the lookup failed otherwise
+        """
+        file_inode = self.get_inode(file_path, verify=False)
+        if type(file_inode) is self._inode_type:
+            return None, self._open_inode(file_path, file_inode, open_flags)[-1]
+        if file_inode != errno.ENOENT:
+            return file_inode, None
+        print(f"file does not exist: {file_path}, it will be created")
+        # the caller writes to the handle and closes it
+        return None, self.create_file(file_path, autoclose=False)[-1]
+
+    def _open_inode(
+            self, file_path, file_inode, open_flags, open_parameters=None, req_flags=None, verify=True
+    ):
+        """Open of an already resolved inode, see open_file"""
+        if not req_flags:
+            req_flags = self._default_req_flags
+        if not open_parameters:
+            open_parameters = self._open_existing_params
         if self.fs_type != "ufo":
             ret_code, handle, target_attr = self.api.Open(
                 self.fs_info, file_inode, req_flags=req_flags, open_flags=open_flags, open_parameters=open_parameters
             )
         else:
+            # only the ufo api takes the parent inode
+            parent_inode = self.get_inode(os.path.split(file_path)[0])
             ret_code, handle, target_attr = self.api.Open(
                 self.fs_info, parent_inode, file_inode, req_flags=req_flags, open_flags=open_flags,
                 open_parameters=open_parameters
             )
 
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
+        self._stash_attrs(file_path, target_attr)
         return ret_code, None, target_attr, handle
 
     def get_attr(self, file_path, verify=True):
@@ -929,16 +1493,24 @@ class FileSystem:
         :param bool verify: if True, check result
         Returns get_attr result if everything ok, error otherwise
         """
+        if verify and self.attr_ttl:
+            cached = self._attr_cache.get(file_path)
+            if cached and time.monotonic() - cached[1] < self.attr_ttl:
+                return cached[0]
         file_inode = self.get_inode(file_path, verify=verify)
-        parent_inode = self.get_inode(os.path.split(file_path)[0], verify=verify)
-        if not isinstance(file_inode, self.fsapi.Inode):
+        if type(file_inode) is not self._inode_type:
             return file_inode
+        # only the ufo api takes the parent inode
+        parent_inode = None
+        if self.fs_type == "ufo":
+            parent_inode = self.get_inode(os.path.split(file_path)[0], verify=verify)
         if self.fs_type != "ufo":
             ret_val = self.api.GetAttr(self.fs_info, file_inode)
         else:
             ret_val = self.api.GetAttr(self.fs_info, parent_inode, file_inode)
         if verify:
-            assert ret_val[0] == 0
+            if ret_val[0] != 0:
+                raise AssertionError(f"ret_code is {ret_val[0]}")
             return ret_val[1:]
         return ret_val[0]
 
@@ -962,11 +1534,14 @@ class FileSystem:
         if not extra_info:
             extra_info = self.fsapi.ExtraInfo()
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         file_inode = self.get_inode(file_path, verify=verify)
-        parent_inode = self.get_inode(os.path.split(file_path)[0], verify=verify)
-        if not isinstance(file_inode, self.fsapi.Inode):
+        if type(file_inode) is not self._inode_type:
             return file_inode
+        # only the ufo api takes the parent inode
+        parent_inode = None
+        if self.fs_type == "ufo":
+            parent_inode = self.get_inode(os.path.split(file_path)[0], verify=verify)
         if self.fs_type != "ufo":
             ret_code, target_attr = self.api.SetAttr(
                 self.fs_info,
@@ -989,8 +1564,9 @@ class FileSystem:
                 req_flags,
             )
 
-        if verify:
-            assert ret_code == 0, f"code returned is {ret_code}"
+        if verify and ret_code != 0:
+            raise AssertionError(f"code returned is {ret_code}")
+        self._stash_attrs(file_path, target_attr)
         return ret_code, target_attr
 
     def rename(self, src_path, dst_path, req_flags=None, verify=True):
@@ -1000,11 +1576,13 @@ class FileSystem:
         Returns the return code of rename operation
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
-        src_parent_inode = self.get_inode(os.path.split(src_path)[0])
-        src_name = os.path.split(src_path)[1]
-        dst_parent_inode = self.get_inode(os.path.split(dst_path)[0])
-        dst_name = os.path.split(dst_path)[1]
+            req_flags = self._default_req_flags
+        src_parent, src_name = os.path.split(src_path)
+        dst_parent, dst_name = os.path.split(dst_path)
+        src_parent_inode = self.get_inode(src_parent)
+        dst_parent_inode = self.get_inode(dst_parent)
+        self._drop_handles(src_path)
+        self._drop_handles(dst_path)
         (
             ret_code,
             from_parent_attr,
@@ -1018,8 +1596,11 @@ class FileSystem:
             dst_name,
             req_flags,
         )
-        if verify:
-            assert ret_code == 0
+        self._cache_invalidate(src_path)
+        self._cache_invalidate(dst_path)
+        self._drop_attrs(src_parent, src_path, dst_parent, dst_path)
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, from_parent_attr, to_parent_attr, target_attr
 
     def setxattr(self, file_path, name, value):
@@ -1030,8 +1611,11 @@ class FileSystem:
         Returns setxattr result if everything ok, error otherwise
         """
         file_inode = self.get_inode(file_path)
-        if not isinstance(file_inode, self.fsapi.Inode):
+        if type(file_inode) is not self._inode_type:
             return file_inode
+        # the xattrs and the change time of the file
+        self._attr_cache.pop(file_path, None)
+        self._xattr_cache.pop(file_path, None)
         return self.api.Setxattr(self.fs_info, file_inode, name, value)
 
     def getxattr(self, file_path, name):
@@ -1041,10 +1625,11 @@ class FileSystem:
         Returns content of attribute if everything ok, error otherwise
         """
         file_inode = self.get_inode(file_path)
-        if not isinstance(file_inode, self.fsapi.Inode):
+        if type(file_inode) is not self._inode_type:
             return file_inode
         ret_val = self.api.Getxattr(self.fs_info, file_inode, name)
-        assert ret_val[0] == 0
+        if ret_val[0] != 0:
+            raise AssertionError(f"ret_code is {ret_val[0]}")
         return ret_val[1]
 
     def listxattr(self, file_path):
@@ -1053,12 +1638,46 @@ class FileSystem:
         Returns attributes for the file/dir if everything ok, error otherwise
         """
         file_inode = self.get_inode(file_path)
-        if not isinstance(file_inode, self.fsapi.Inode):
+        if type(file_inode) is not self._inode_type:
             return file_inode
         ret_val = self.api.Listxattr(self.fs_info, file_inode)
-        assert ret_val[0] == 0
+        if ret_val[0] != 0:
+            raise AssertionError(f"ret_code is {ret_val[0]}")
         return ret_val[1]
 
+    def get_all_xattrs(self, file_path):
+        """Lists the xattrs of a file/dir and reads all of them, the Getxattr
+        requests are sent in parallel on the io pool
+        :param str file_path: path of the file
+        Returns {name: value} if everything ok, error otherwise
+        """
+        if file_path in self._xattr_cache:
+            return dict(self._xattr_cache[file_path])
+        file_inode = self.get_inode(file_path)
+        if type(file_inode) is not self._inode_type:
+            return file_inode
+        ret_val = self.api.Listxattr(self.fs_info, file_inode)
+        if ret_val[0] != 0:
+            raise AssertionError(f"ret_code is {ret_val[0]}")
+        names = list(ret_val[1])
+
+        def getxattr(name):
+            # runs on the io pool, a failed Getxattr must not end up in the result (or the cache)
+            ret_val = self.api.Getxattr(self.fs_info, file_inode, name)
+            if ret_val[0] != 0:
+                raise AssertionError(f"ret_code is {ret_val[0]} for {name}")
+            return ret_val[1]
+
+        if len(names) < 2:
+            values = [getxattr(name) for name in names]
+        else:
+            values = self._io_pool.map(getxattr, names)
+        xattrs = dict(zip(names, values))
+        if self.cache_xattrs:
+            self._xattr_cache[file_path] = xattrs
+            return dict(xattrs)
+        return xattrs
+
     def removexattr(self, file_path, name):
         """removexattr operation
         :param str file_path: path of the file
@@ -1066,8 +1685,10 @@ class FileSystem:
         Returns removexattr result if everything ok, error otherwise
         """
         file_inode = self.get_inode(file_path)
-        if not isinstance(file_inode, self.fsapi.Inode):
+        if type(file_inode) is not self._inode_type:
             return file_inode
+        self._attr_cache.pop(file_path, None)
+        self._xattr_cache.pop(file_path, None)
         ret_val = self.api.Removexattr(self.fs_info, file_inode, name)
         return ret_val
 
@@ -1090,12 +1711,12 @@ class FileSystem:
         Returns link result if everything ok, error otherwise
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         dst_parent_inode = self.get_inode(dst_parent_folder, verify=False)
-        if not isinstance(dst_parent_inode, self.fsapi.Inode):
+        if type(dst_parent_inode) is not self._inode_type:
             return dst_parent_inode, None, None
         target_inode = self.get_inode(src_path, verify=False)
-        if not isinstance(target_inode, self.fsapi.Inode):
+        if type(target_inode) is not self._inode_type:
             return target_inode, None, None
 
         ret_code, parent_attr, target_attr = self.api.Link(
@@ -1105,8 +1726,9 @@ class FileSystem:
             target_inode,
             req_flags=req_flags,
         )
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
+        self._drop_attrs(src_path, dst_parent_folder)
         return ret_code, parent_attr, target_attr
 
     def unlink(self, file_path, req_flags=None, verify=True):
@@ -1118,18 +1740,21 @@ class FileSystem:
         Returns unlink result if everything ok, error otherwise
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
-        parent_folder = os.path.split(file_path)[0]
+            req_flags = self._default_req_flags
+        parent_folder, file_name = os.path.split(file_path)
         parent_inode = self.get_inode(parent_folder)
-        if not isinstance(parent_inode, self.fsapi.Inode):
+        if type(parent_inode) is not self._inode_type:
             return parent_inode, None, None
-        file_name = os.path.split(file_path)[1]
 
+        # cached handles would keep the file open
+        self._drop_handles(file_path)
         ret_code, parent_attr, target_attr = self.api.Unlink(
             self.fs_info, parent_inode, file_name, req_flags
         )
-        if verify:
-            assert ret_code == 0
+        self._cache_invalidate(file_path)
+        self._drop_attrs(parent_folder, file_path)
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, parent_attr, target_attr
 
     def read_link(
@@ -1147,18 +1772,20 @@ class FileSystem:
         :param bool verify: if True, check result
         Returns the content (bytes) read on ReadLink operation
         """
+        if length == 0:
+            return 0, None, None, b""
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         link_inode = self.get_inode(link_path, verify=False)
-        if not isinstance(link_inode, self.fsapi.Inode):
+        if type(link_inode) is not self._inode_type:
             print(f"Error getting inode of: {link_path}: {link_inode}")
             return link_inode, None, None, None
 
         ret_code, read_result, target_attr = self.api.ReadLink(
             self.fs_info, link_inode, req_flags=req_flags, length=length
         )
-        if verify:
-            assert ret_code == length
+        if verify and ret_code != length:
+            raise AssertionError(f"ret_code is {ret_code}, expected {length}")
         return ret_code, None, target_attr, read_result
 
     def symlink(
@@ -1183,19 +1810,14 @@ class FileSystem:
         Returns link result if everything ok, error otherwise
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
+            req_flags = self._default_req_flags
         dst_parent_inode = self.get_inode(dst_parent_folder, verify=False)
-        if not isinstance(dst_parent_inode, self.fsapi.Inode):
+        if type(dst_parent_inode) is not self._inode_type:
             return dst_parent_inode, None, None
         if not stat_info:
-            stat_info = self.fsapi.StatInfo()
-            for key, val in STAT_TYPICAL_VALUES.items():
-                stat_info.__setattr__(key, val)
-            stat_info.unix_mode = stat.S_IFLNK | 0o777
+            stat_info = self._make_stat_info(S_IFLNK | 0o777)
         if not extra_info:
-            extra_info = self.fsapi.ExtraInfo()
-            for key, val in EXTRA_INFO_TYPICAL_VALUES.items():
-                extra_info.__setattr__(key, val)
+            extra_info = self._default_extra_info
 
         ret_code, inode, parent_attr, target_attr = self.api.SymLink(
             self.fs_info,
@@ -1206,8 +1828,9 @@ class FileSystem:
             req_flags,
             link_target,
         )
-        if verify:
-            assert ret_code == 0
+        self._drop_attrs(dst_parent_folder)
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, parent_attr, target_attr, inode
 
     def rmdir(self, folder_path, req_flags=None, verify=True):
@@ -1219,18 +1842,20 @@ class FileSystem:
         Returns rmdir result if everything ok, error otherwise
         """
         if not req_flags:
-            req_flags = self.fsapi.RequestFlags()
-        folder_name = os.path.split(folder_path)[1]
-        parent_folder = os.path.split(folder_path)[0]
+            req_flags = self._default_req_flags
+        parent_folder, folder_name = os.path.split(folder_path)
         parent_inode = self.get_inode(parent_folder)
-        if not isinstance(parent_inode, self.fsapi.Inode):
+        if type(parent_inode) is not self._inode_type:
             return parent_inode
 
+        self._drop_handles(folder_path)
         ret_code, parent_attr = self.api.RmDir(
             self.fs_info, parent_inode, folder_name, req_flags
         )
-        if verify:
-            assert ret_code == 0
+        self._cache_invalidate(folder_path)
+        self._drop_attrs(parent_folder, folder_path)
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, parent_attr, None
 
     def create_snapshot(
@@ -1246,8 +1871,8 @@ class FileSystem:
                 timeout=5,
                 port=55551,
             )
-            if verify:
-                assert retcode == 0
+            if verify and retcode != 0:
+                raise AssertionError(f"retcode is {retcode}")
             return retcode, retval
         elif self.fs_type == "sofs":
             import cephfs
@@ -1288,51 +1913,20 @@ class FileSystem:
 
             retcode, retval = 0, {"snapshotId": snapshot_stat.st_dev}
             # update VCM mockoon
-            for key, val in {
-                "testsnap-44": 22,
-                "testsnap-45": 23,
-                "testsnap-46": 24,
-            }.items():
-                out = subprocess.call(
-                    f'cat /tmp/vcmLocalRESTForSOFS.json | grep "{key}"',
-                    stderr=subprocess.PIPE,
-                    shell=True,
-                    timeout=20,
-                )
-                if out == 0:
+            mockoon = read_vcm_mockoon()
+            for key, val in VCM_MOCKOON_SNAPSHOTS.items():
+                if key in mockoon:
                     replace_snap_name = key
                     replace_snap_id = val
                     break
-            subprocess.check_output(
-                f"sed -i \"s/: {replace_snap_id}/: {retval['snapshotId']}/g\" /tmp/vcmLocalRESTForSOFS.json",
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
-            subprocess.check_output(
-                f'sed -i "s/{replace_snap_name}/_{snap_name}_{parent_stat.st_ino}/g" /tmp/vcmLocalRESTForSOFS.json',
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
-            subprocess.check_output(
-                f'sed -i "s/test-apid/app1/g" /tmp/vcmLocalRESTForSOFS.json',
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
-            subprocess.check_output(
-                f"sed -i \"s/snapshotId={replace_snap_id}/snapshotId={retval['snapshotId']}/g\" /tmp/vcmLocalRESTForSOFS.json",
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
-            subprocess.check_output(
-                f"sed -i 's/\"value\": \"{replace_snap_id}\"/\"value\": \"{retval['snapshotId']}\"/g' /tmp/vcmLocalRESTForSOFS.json",
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
+            snapshot_id = retval["snapshotId"]
+            write_vcm_mockoon(mockoon, [
+                (f": {replace_snap_id}", f": {snapshot_id}"),
+                (replace_snap_name, f"_{snap_name}_{parent_stat.st_ino}"),
+                ("test-apid", "app1"),
+                (f"snapshotId={replace_snap_id}", f"snapshotId={snapshot_id}"),
+                (f'"value": "{replace_snap_id}"', f'"value": "{snapshot_id}"'),
+            ])
             restart_vcm_mockoon(default=False)
             return retcode, retval, f"_{snap_name}_{parent_stat.st_ino}"
         elif self.fs_type == "fsapi":
@@ -1340,8 +1934,8 @@ class FileSystem:
             retcode, snap_id = self.api.CreateSnapshot(
                 "/tmp/passthru_fs", snap_name, app_search_id, reason
             )
-            if verify:
-                assert retcode == 0
+            if verify and retcode != 0:
+                raise AssertionError(f"retcode is {retcode}")
             retval = {"snapshotId": snap_id}
 
         return retcode, retval
@@ -1354,8 +1948,8 @@ class FileSystem:
                 timeout=5,
                 port=55551,
             )
-            if verify:
-                assert retcode == 0
+            if verify and retcode != 0:
+                raise AssertionError(f"retcode is {retcode}")
             return retcode, retval
         elif self.fs_type == "sofs":
             volume, subvol, subv_path = get_ceph_info()
@@ -1384,51 +1978,19 @@ class FileSystem:
                 log.error(exp)
                 return False
             # update VCM mockoon
-            for key, val in {
-                "testsnap-44": 22,
-                "testsnap-45": 23,
-                "testsnap-46": 24,
-            }.items():
-                out = subprocess.call(
-                    f'cat /tmp/vcmLocalRESTForSOFS.json | grep "{key}"',
-                    stderr=subprocess.PIPE,
-                    shell=True,
-                    timeout=20,
-                )
-                if out != 0:
+            mockoon = read_vcm_mockoon()
+            for key, val in VCM_MOCKOON_SNAPSHOTS.items():
+                if key not in mockoon:
                     replace_snap_name = key
                     replace_snap_id = val
                     break
-            subprocess.check_output(
-                f'sed -i "s/: {snapshot_id}/: {replace_snap_id}/g" /tmp/vcmLocalRESTForSOFS.json',
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
-            subprocess.check_output(
-                f'sed -i "s/{snapshot_name}/{replace_snap_name}/g" /tmp/vcmLocalRESTForSOFS.json',
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
-            subprocess.check_output(
-                f'sed -i "s/app1/test-apid/g" /tmp/vcmLocalRESTForSOFS.json',
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
-            subprocess.check_output(
-                f'sed -i \'s/"value": "{snapshot_id}"/"value": "{replace_snap_id}"/g\' /tmp/vcmLocalRESTForSOFS.json',
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
-            subprocess.check_output(
-                f'sed -i "s/snapshotId={snapshot_id}/snapshotId={replace_snap_id}/g" /tmp/vcmLocalRESTForSOFS.json',
-                stderr=subprocess.PIPE,
-                shell=True,
-                timeout=20,
-            )
+            write_vcm_mockoon(mockoon, [
+                (f": {snapshot_id}", f": {replace_snap_id}"),
+                (snapshot_name, replace_snap_name),
+                ("app1", "test-apid"),
+                (f'"value": "{snapshot_id}"', f'"value": "{replace_snap_id}"'),
+                (f"snapshotId={snapshot_id}", f"snapshotId={replace_snap_id}"),
+            ])
             restart_vcm_mockoon(default=False)
             retcode, retval = 0, None
             return retcode, retval
@@ -1436,8 +1998,8 @@ class FileSystem:
             snap_id = int(1)
             # create snapshot calling function
             retcode = self.api.DeleteSnapshot(1)
-            if verify:
-                assert retcode == 0
+            if verify and retcode != 0:
+                raise AssertionError(f"retcode is {retcode}")
             retval = None
         return retcode, retval
 
@@ -1451,8 +2013,8 @@ class FileSystem:
             app_search_ids,
             snapshot_names,
         ) = self.api.ListSnapshots(self.fs_info, offset, buffer_size)
-        if verify:
-            assert ret_code == 0
+        if verify and ret_code != 0:
+            raise AssertionError(f"ret_code is {ret_code}")
         return ret_code, snap_entries, app_search_ids, snapshot_names
 
     def get_snapshot_info(self, snapshot_id, buffer_size=1024, verify=True):
@@ -1465,8 +2027,6 @@ class FileSystem:
         ret_code, snap_info, app_search_id, name = self.api.GetSnapshotInfo(
             self.fs_info, snapshot_id, buffer_size
         )
-        if verify:
-            assert (
-                    ret_code == 0
-            ), f"Unable to get snapshot info for id {snapshot_id}"
+        if verify and ret_code != 0:
+            raise AssertionError(f"Unable to get snapshot info for id {snapshot_id}")
         return ret_code, snap_info, app_search_id, name
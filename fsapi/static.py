@@ -1,8 +1,9 @@
 # pylint: disable-all
-import pytz
-from calendar import timegm
 import stat
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, reduce
+from operator import and_, itemgetter, or_
 import logging as log
 
 # Section 1 - HELPER CONSTANTS DEFINITIONS
@@ -13,8 +14,20 @@ BLOCK_SIZE = 4096
 NODE_PROPAGATION_DELAY = 0.50
 MAX_STREAMS = 1024
 MAX_STREAM_NAME_LENGTH = 255
-
-STAT_INFO_ATTRS = [
+INODE_CACHE_SIZE = 4096
+CLOSE_BATCH_SIZE = 16
+HANDLE_CACHE_SIZE = 128
+IO_POOL_WORKERS = 8
+WRITE_COALESCE_BYTES = 1024 * 1024
+WRITE_COALESCE_COUNT = 32
+FILETIME_CACHE_SIZE = 4096
+REQS_CACHE_SIZE = 256
+# file type bits, imported from here by the fs helpers
+S_IFDIR = stat.S_IFDIR
+S_IFREG = stat.S_IFREG
+S_IFLNK = stat.S_IFLNK
+
+STAT_INFO_ATTRS = (
     "accessed_time",
     "bytes_used",
     "created_time",
@@ -26,9 +39,9 @@ STAT_INFO_ATTRS = [
     "uid",
     "unix_mode",
     "userdata_modified_time",
-]
+)
 
-EXTRA_INFO_ATTRS = [
+EXTRA_INFO_ATTRS = (
     "dos_flags",
     "file_feature_flags",
     "file_type",
@@ -38,7 +51,7 @@ EXTRA_INFO_ATTRS = [
     "virtual_volume_tag_number",
     "virus_scan_version_number",
     "volume_virus_scan_id",
-]
+)
 
 STAT_TYPICAL_VALUES = {
     "accessed_time": 137919572471111111,
@@ -50,14 +63,14 @@ STAT_TYPICAL_VALUES = {
     "nlink": 1,
     "spec_data": 0,
     "uid": 1000,
-    "unix_mode": 0o755 | stat.S_IFDIR,
+    "unix_mode": 0o755 | S_IFDIR,
     "userdata_modified_time": 137919572474444444,
 }
 
 EXTRA_INFO_TYPICAL_VALUES = {
     "dos_flags": 0,
     "file_feature_flags": 2,
-    "file_type": stat.S_IFDIR,
+    "file_type": S_IFDIR,
     "parent_cookie": 4,
     "security_descriptor_object_number": 5,
     "software_metadata_object_number": 6,
@@ -76,7 +89,7 @@ STAT_MAX_VALUES = {
     "nlink": 0xFFFFFFFF,
     "spec_data": 0xFFFFFFFF,
     "uid": 0xFFFFFFFF - 1,
-    "unix_mode": 0o755 | stat.S_IFDIR,
+    "unix_mode": 0o755 | S_IFDIR,
     "userdata_modified_time": 137919572470000000,
 }
 
@@ -92,51 +105,94 @@ EXTRA_INFO_MAX_VALUES = {
     "volume_virus_scan_id": 0xFFFF,
 }
 
+# the same values as fixed records, for code that knows the field it wants (STAT_MAX.length)
+StatInfoValues = namedtuple("StatInfoValues", STAT_INFO_ATTRS)
+ExtraInfoValues = namedtuple("ExtraInfoValues", EXTRA_INFO_ATTRS)
+STAT_TYPICAL = StatInfoValues(**STAT_TYPICAL_VALUES)
+EXTRA_INFO_TYPICAL = ExtraInfoValues(**EXTRA_INFO_TYPICAL_VALUES)
+STAT_MAX = StatInfoValues(**STAT_MAX_VALUES)
+EXTRA_INFO_MAX = ExtraInfoValues(**EXTRA_INFO_MAX_VALUES)
+
 
 # Section 2 - HELPER FUNCTIONS
 
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_NAIVE = datetime(1970, 1, 1)
+
+
+# tests convert the same few timestamps over and over, both conversions are pure
+@lru_cache(maxsize=FILETIME_CACHE_SIZE)
 def filetime_to_dt(filetime):
     """Converts a Microsoft filetime number to a Python datetime.
     :param int filetime: timestamp in filetime format
     It returns value in UTC (timezone aware)
     """
     usec = (filetime - EPOCH_AS_FILETIME) // 10
-    utc_time = datetime(1970, 1, 1) + timedelta(microseconds=usec)
-    return utc_time.replace(tzinfo=pytz.UTC)
+    return _EPOCH + timedelta(microseconds=usec)
 
 
+@lru_cache(maxsize=FILETIME_CACHE_SIZE)
 def dt_to_filetime(dat_time):
     """Converts a python datetime into Microsoft filetime number.
     :param int dat_time: timestamp in datetime format
+    Naive datetimes are taken as UTC, sub-second precision is dropped
     """
-    return EPOCH_AS_FILETIME + (timegm(dat_time.timetuple()) * 10000000)
+    # a plain subtraction, no timetuple/timegm round-trip
+    delta = dat_time - (_EPOCH_NAIVE if dat_time.utcoffset() is None else _EPOCH)
+    # timedelta keeps seconds in [0, 86400), so this is already the floor of the seconds
+    return EPOCH_AS_FILETIME + (delta.days * 86400 + delta.seconds) * HUNDREDS_OF_NANOSECONDS
 
 
-def verify_returned_flag_field(flag, pre=None, stat_post=None, extra_post=None):
+def verify_returned_flag_field(flag, pre=None, stat_post=None, extra_post=None, expected=None):
     """Verifies that flag corresponds to the case,
     depending if pre/post attr are set.
     :param AttributeFlags flag: Flag returned in Pre/Post attrs
     :param boolean pre: True if pre attr were requested
     :param boolean stat_post: True if stat_post attr were requested
     :param boolean extra_post: True if extra_post attr were requested
+    :param int expected: AttributeFlags bitmask already built by the caller,
+    pre/stat_post/extra_post are ignored when provided
     """
-    expected_result = 0
-    if pre:
-        expected_result |= AttributeFlags.PRE_OP
-    if stat_post:
-        expected_result |= AttributeFlags.STAT_POST_OP
-    if extra_post:
-        expected_result |= AttributeFlags.EXTRA_POST_OP
-
+    if expected is not None:
+        if flag != expected:
+            log.error("%s does not correspond to expected flags %s", flag, expected)
+            return
+        return True
+    expected_result = _RETURNED_FLAGS[bool(pre), bool(stat_post), bool(extra_post)]
     if flag != expected_result:
         log.error(
-            f"{flag} does not correspond to stat_post:{stat_post}, stat_post:{extra_post}, pre:{pre}"
+            "%s does not correspond to stat_post:%s, extra_post:%s, pre:%s", flag, stat_post, extra_post, pre
         )
         return
     return True
 
 
+def split_path(file_path):
+    """Returns the components of file_path, relative to the fs root.
+    Empty components are dropped, so leading, trailing and duplicate slashes are all fine
+    :param str file_path: path of the file/dir
+    """
+    return [level for level in file_path.split("/") if level]
+
+
+def make_attrs_setter(values, name="set_attrs"):
+    """Returns a function setting all values on the object it receives.
+    The function is generated with one plain assignment per attribute,
+    so no dict is iterated on each call. Values must be literals (their repr is used)
+    :param dict values: attribute name -> value
+    :param str name: name of the generated function
+    """
+    body = "".join(f"    obj.{key} = {val!r}\n" for key, val in values.items()) or "    pass\n"
+    namespace = {}
+    exec(f"def {name}(obj):\n{body}", namespace)
+    return namespace[name]
+
+
+apply_typical_stat = make_attrs_setter(STAT_TYPICAL_VALUES, "apply_typical_stat")
+apply_typical_extra_info = make_attrs_setter(EXTRA_INFO_TYPICAL_VALUES, "apply_typical_extra_info")
+
+
 # Section 3 - HELPER CLASSES
 
 
@@ -155,12 +211,19 @@ class AccessModes:
     WRITE = 0x0002
     DELETE = 0x0004
     UNLINK = 0x0010
+    _ALL_MODES = READ | WRITE | DELETE | UNLINK
 
     @classmethod
     def mode_to_string(cls, mode):
         """Return a string representation of the mode
         :param int mode: access/shared mode
         """
+        # only the known bits are named, so there are few enough strings to build each once
+        return cls._mode_to_string(mode & cls._ALL_MODES)
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _mode_to_string(cls, mode):
         return ','.join(
             ac[0] for ac in [
                 ("READ", cls.READ),
@@ -174,11 +237,11 @@ class AccessModes:
         """Return a string representation of the existing handlers
         :param dict existing_handlers: Existing handlers dictionary
         """
-        handler_string = ""
-        for key, val in existing_handlers.items():
-            handler_string += (f"Handler {key} - access_mode: {cls.mode_to_string(val[1])}"
-                               f" - shared_mode: {cls.mode_to_string(val[2])}\n")
-        return handler_string[:-1] if len(handler_string) > 0 else "No handlers open"
+        return "\n".join(
+            f"Handler {key} - access_mode: {cls.mode_to_string(val[1])}"
+            f" - shared_mode: {cls.mode_to_string(val[2])}"
+            for key, val in existing_handlers.items()
+        ) or "No handlers open"
 
     @classmethod
     def existing_handlers_check(cls, existing_handlers, input_access_mode, input_share_mode):
@@ -187,30 +250,83 @@ class AccessModes:
         :param int input_access_mode: Input access mode
         :param int input_share_mode: Input share mode
         """
-        if len(existing_handlers) == 0:
+        if not existing_handlers:
             return True
-        am_cum = 0
-        sh_cum = 7
-        for am in existing_handlers.values():
-            am_cum |= am[1]
-            sh_cum &= am[2]
-        if input_access_mode & sh_cum != input_access_mode:
-            log.debug(f"Access mode {cls.mode_to_string(input_access_mode)} "
-                      f"not compatible with current cumulative shared_mode {cls.mode_to_string(sh_cum)}\n"
-                      f"These are the current handlers open and the accesses they set on the call:\n"
-                      f"{cls.existing_handlers_to_string(existing_handlers)}\n"
-                      f"Current cumulative shared_mode: {cls.mode_to_string(sh_cum)}\n"
-                      f"Current cumulative access_mode: {cls.mode_to_string(am_cum)}\n")
+        if isinstance(existing_handlers, HandlerTable):
+            am_cum, sh_cum = existing_handlers.cumulative_modes
+        else:
+            am_cum, sh_cum = cumulative_modes(existing_handlers.values())
+        # accesses not shared by the open handlers, accesses of the open handlers not shared by the input
+        denied_access = input_access_mode & ~sh_cum
+        if not (denied_access | am_cum & ~input_share_mode):
+            return True
+        if denied_access:
+            # the message lists every handler, only build it when it is going to be logged
+            if log.getLogger().isEnabledFor(log.DEBUG):
+                log.debug(f"Access mode {cls.mode_to_string(input_access_mode)} "
+                          f"not compatible with current cumulative shared_mode {cls.mode_to_string(sh_cum)}\n"
+                          f"These are the current handlers open and the accesses they set on the call:\n"
+                          f"{cls.existing_handlers_to_string(existing_handlers)}\n"
+                          f"Current cumulative shared_mode: {cls.mode_to_string(sh_cum)}\n"
+                          f"Current cumulative access_mode: {cls.mode_to_string(am_cum)}\n")
             return False
-        if input_share_mode & am_cum != am_cum:
+        if log.getLogger().isEnabledFor(log.DEBUG):
             log.debug(f"Share mode {cls.mode_to_string(input_share_mode)} "
                       f"not compatible with current cumulative access_mode {cls.mode_to_string(am_cum)}\n"
                       f"These are the current handlers open and the accesses they set on the call: \n"
                       f"{cls.existing_handlers_to_string(existing_handlers)}\n"
                       f"Current cumulative shared_mode: {cls.mode_to_string(sh_cum)}\n"
                       f"Current cumulative access_mode: {cls.mode_to_string(am_cum)}\n")
-            return False
-        return True
+        return False
+
+
+def cumulative_modes(handlers):
+    """Returns the cumulative access mode (OR) and share mode (AND) of the handlers
+    :param iterable handlers: (handle, access_mode, share_mode) tuples
+    """
+    handlers = tuple(handlers)
+    return reduce(or_, map(itemgetter(1), handlers), 0), reduce(and_, map(itemgetter(2), handlers), 7)
+
+
+class HandlerTable(dict):
+    """Existing handlers dictionary, as taken by AccessModes.existing_handlers_check,
+    that keeps the cumulative access/share modes of its handlers so the check doesn't
+    fold all of them on every call. Adding a handler updates them in place, anything
+    else recomputes them on the next check as the AND of the share modes can't be undone
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cumulative = None
+
+    @property
+    def cumulative_modes(self):
+        if self._cumulative is None:
+            self._cumulative = cumulative_modes(self.values())
+        return self._cumulative
+
+    def __setitem__(self, key, value):
+        if self._cumulative is not None and key not in self:
+            self._cumulative = (self._cumulative[0] | value[1], self._cumulative[1] & value[2])
+        else:
+            self._cumulative = None
+        super().__setitem__(key, value)
+
+    def _invalidate(name):
+        def method(self, *args, **kwargs):
+            self._cumulative = None
+            return getattr(dict, name)(self, *args, **kwargs)
+        method.__name__ = name
+        return method
+
+    __delitem__ = _invalidate("__delitem__")
+    __ior__ = _invalidate("__ior__")
+    pop = _invalidate("pop")
+    popitem = _invalidate("popitem")
+    clear = _invalidate("clear")
+    update = _invalidate("update")
+    setdefault = _invalidate("setdefault")
+    del _invalidate
 
 
 class AttributeFlags:
@@ -219,6 +335,19 @@ class AttributeFlags:
     EXTRA_POST_OP = 0x00000004
 
 
+# (pre, stat_post, extra_post) requested -> flags expected back, see verify_returned_flag_field
+_RETURNED_FLAGS = {
+    (pre, stat_post, extra_post): (
+        (AttributeFlags.PRE_OP if pre else 0)
+        | (AttributeFlags.STAT_POST_OP if stat_post else 0)
+        | (AttributeFlags.EXTRA_POST_OP if extra_post else 0)
+    )
+    for pre in (False, True)
+    for stat_post in (False, True)
+    for extra_post in (False, True)
+}
+
+
 # Section 2 - HELPER CLASSES
 class OpRequirements:
     UPDATE_METADATA_MODIFIED = 0x02
@@ -243,9 +372,16 @@ class OpRequirements:
 
     @classmethod
     def fields_to_reqs(cls, fields):
+        # the order of the fields doesn't matter, the same few sets come back every check
+        return cls._fields_to_reqs(frozenset(fields))
+
+    @classmethod
+    @lru_cache(maxsize=REQS_CACHE_SIZE)
+    def _fields_to_reqs(cls, fields):
+        field_flags = cls.FIELD_FLAG_DICT
         reqs = 0
         for field in fields:
-            reqs |= cls.FIELD_FLAG_DICT[field]
+            reqs |= field_flags[field]
         return reqs
 
 
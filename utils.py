@@ -3,22 +3,57 @@
 # pylint: disable=too-many-arguments,duplicate-code
 # pylint: disable-all
 import datetime
+import errno
 import logging as log
 import os
 import json
 import random
 import re
 import sys
+import shlex
 import subprocess
 import string
 import time
 import threading
 import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import List
 from urllib.parse import urlparse, parse_qs
 import pytz
 
+try:
+    # optional, faster drop-in for json.loads in load_json_with_default
+    import orjson
+except ImportError:
+    orjson = None
+
+REGEX_CACHE_SIZE = 256
+LOG_READ_SIZE = 65536
+TIMEZONE_CACHE_SIZE = 64
+XATTR_COMPARE_WORKERS = 32
+XATTR_CACHE_SIZE = 65536
+DIAG_COLLECT_WORKERS = 32
+_UTC = datetime.timezone.utc
+_VALID_FILENAME_RE = re.compile(r'(?u)[^-\w.]')
+# translate table deleting what _VALID_FILENAME_RE removes, for the common all-ascii names
+_INVALID_ASCII_FILENAME_CHARS = dict.fromkeys(
+    code for code in range(128) if chr(code) not in string.ascii_letters + string.digits + '-_.'
+)
+_URL_TEMPLATE_PARAM_RE = re.compile(r'\\{[a-zA-Z0-9_\-]+\\}')
+
+
+@lru_cache(maxsize=REGEX_CACHE_SIZE)
+def _compile_regex(regex):
+    """ Returns the compiled regex, memoized as the regex helpers get called in loops with the same few patterns
+
+    :param str regex:
+    :return: Compiled pattern
+    :rtype: re.Pattern
+    """
+    return re.compile(regex)
+
 
 def list_to_str(array: list, separator: str = ',') -> str:
     """ Converts lists to string, using passed separator (default is ',')
@@ -74,7 +109,7 @@ def get_current_date_datetime(in_utc: bool = True) -> datetime.datetime:
     :return: datetime object as local or utc
     :rtype: datetime.datetime
     """
-    return datetime.datetime.now(datetime.timezone.utc) if in_utc else datetime.datetime.now()
+    return datetime.datetime.now(_UTC) if in_utc else datetime.datetime.now()
 
 
 def get_current_utc_date_time_formatted(date_format: str) -> str:
@@ -86,12 +121,9 @@ def get_current_utc_date_time_formatted(date_format: str) -> str:
     :return: Current utc date/time in requested format
     :rtype: str
     """
-    current_formatted_time = format_datetime_into_str(get_current_date_datetime(in_utc=True), date_format)
-
-    if date_format[-1] == "f":
-        # to cut off needlessly accurate microseconds after 3 digits
-        return current_formatted_time[:-3]
-    return current_formatted_time
+    current_formatted_time = datetime.datetime.now(_UTC).strftime(date_format)
+    # to cut off needlessly accurate microseconds after 3 digits
+    return current_formatted_time[:-3] if date_format.endswith("f") else current_formatted_time
 
 
 def get_current_timezone_date_time_formatted(date_format: str, country_code_iso_3166: str = 'gb') -> str:
@@ -104,15 +136,22 @@ def get_current_timezone_date_time_formatted(date_format: str, country_code_iso_
     :return: Current utc date/time in requested format
     :rtype: str
     """
-    timezone_str = ' '.join(pytz.country_timezones[country_code_iso_3166])
-    utc = pytz.timezone('UTC')
-    now = utc.localize(datetime.datetime.now(datetime.timezone.utc))
-    timezone = pytz.timezone(timezone_str)
-    local_time = now.astimezone(timezone)
+    local_time = datetime.datetime.now(pytz.utc).astimezone(_country_timezone(country_code_iso_3166))
 
     return local_time.strftime(date_format)
 
 
+@lru_cache(maxsize=TIMEZONE_CACHE_SIZE)
+def _country_timezone(country_code_iso_3166: str):
+    """ Returns the pytz timezone of a country, built once per country
+
+    :param str country_code_iso_3166:
+    :return: Timezone of the country
+    :rtype: datetime.tzinfo
+    """
+    return pytz.timezone(' '.join(pytz.country_timezones[country_code_iso_3166]))
+
+
 def format_datetime_into_str(date_time: datetime.datetime, date_format: str) -> str:
     """ Returns string representation of passed-in date/time in requested format
 
@@ -129,6 +168,15 @@ def format_datetime_into_str(date_time: datetime.datetime, date_format: str) ->
     return date_time.strftime(date_format)
 
 
+# formats fromisoformat parses identically to strptime: expected length and separator positions,
+# anything else (e.g. 3.11 week dates or offsets) goes through strptime
+_ISO_LIKE_FORMATS = {
+    '%Y-%m-%d': (10, ((4, '-'), (7, '-'))),
+    '%Y-%m-%dT%H:%M:%S': (19, ((4, '-'), (7, '-'), (10, 'T'), (13, ':'), (16, ':'))),
+    '%Y-%m-%d %H:%M:%S': (19, ((4, '-'), (7, '-'), (10, ' '), (13, ':'), (16, ':'))),
+}
+
+
 def parse_str_into_datetime(date_time_str: str, date_format: str) -> datetime.datetime:
     """ Parses date_time object into str based on passed-in date format
 
@@ -142,12 +190,23 @@ def parse_str_into_datetime(date_time_str: str, date_format: str) -> datetime.da
     :return: Date_time object with value matching input, or matching 1970-01-01 in case of an error
     :rtype: datetime.datetime
     """
+    iso_like = _ISO_LIKE_FORMATS.get(date_format)
+    if iso_like is not None and isinstance(date_time_str, str) and len(date_time_str) == iso_like[0] \
+            and all(date_time_str[i] == c for i, c in iso_like[1]):
+        # fromisoformat is C implemented, strptime re-interprets the format on every call
+        try:
+            return datetime.datetime.fromisoformat(date_time_str)
+        except ValueError:
+            pass
     try:
         return datetime.datetime.strptime(date_time_str, date_format)
     except (TypeError, ValueError):
         return get_zero_date_datetime()
 
 
+_EPOCH_NAIVE = datetime.datetime(1970, 1, 1)
+
+
 def datetime_to_epoch(date_a: datetime.datetime) -> int:
     """ Converts date_time object into UNIX time 'epoch' integer
 
@@ -159,10 +218,10 @@ def datetime_to_epoch(date_a: datetime.datetime) -> int:
     :return: Int value matching seconds passed since 1970-01-01
     :rtype: int
     """
-    # create 1,1,1970 in same timezone as d1
-    date_b = datetime.datetime(1970, 1, 1, tzinfo=date_a.tzinfo)
-    time_delta = date_a - date_b
-    return int(time_delta.total_seconds())
+    if date_a.tzinfo:
+        return int(date_a.timestamp())
+    # naive datetimes are taken as UTC
+    return int((date_a - _EPOCH_NAIVE).total_seconds())
 
 
 def create_folder_if_does_not_exist(path_to_folder: str):
@@ -189,7 +248,9 @@ def get_valid_filename(file_name: str) -> str:
     :rtype: str
     """
     file_name = file_name.strip().replace(' ', '_')
-    return re.sub(r'(?u)[^-\w.]', '', file_name)
+    if file_name.isascii():
+        return file_name.translate(_INVALID_ASCII_FILENAME_CHARS)
+    return _VALID_FILENAME_RE.sub('', file_name)
 
 
 def get_file_name_from_end_of_file_path(separator: str, file_path: str) -> str:
@@ -200,8 +261,8 @@ def get_file_name_from_end_of_file_path(separator: str, file_path: str) -> str:
     :return: Last entry of split path, or full path if split doesn't work
     :rtype: str
     """
-    path_array = file_path.split(separator)
-    return path_array[-1] if path_array else file_path
+    # rpartition returns ('', '', file_path) when the separator is absent
+    return file_path.rpartition(separator)[2]
 
 
 def get_file_name_from_path_with_pathlib(path: str) -> str:
@@ -225,8 +286,8 @@ def get_last_created_files_in_folder(
 ) -> list:
     """ Returns list of last created files from a specified folder
 
-    The logic sorts the found paths based on their os.path.getmtime attribute,
-    more information: https://docs.python.org/3.10/library/os.path.html#os.path.getmtime
+    The logic sorts the found paths based on their modification time, taken from the stat
+    cached by os.scandir, more information: https://docs.python.org/3.10/library/os.html#os.DirEntry.stat
 
     Flag "with_path" appends full path to the return file names
 
@@ -242,16 +303,15 @@ def get_last_created_files_in_folder(
     :rtype:
     """
     try:
-        paths = sorted(Path(folder_path).iterdir(), key=os.path.getmtime)
-        path_strings = []
-        for path_entry in paths:
-            if path_entry.name not in exception_file_name_list:
-                if with_path:
-                    path_strings.append(os.path.join(folder_path, path_entry.name))
-                else:
-                    path_strings.append(path_entry.name)
+        with os.scandir(folder_path) as dir_entries:
+            entries = [entry for entry in dir_entries if entry.name not in exception_file_name_list]
+        # the sort keys are computed in list order, in inode order the stats walk the inode table
+        # sequentially instead of seeking for every entry on large cold directories
+        entries.sort(key=os.DirEntry.inode)
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        path_strings = [entry.path if with_path else entry.name for entry in entries]
         if number_of_files_needed >= 0:
-            return path_strings[min(len(path_strings), len(path_strings)-number_of_files_needed):]
+            return path_strings[max(0, len(path_strings) - number_of_files_needed):]
 
         return path_strings
     except FileNotFoundError:
@@ -268,11 +328,9 @@ def fashion_url_with_slash(host: str, override_character: str = "/") -> str:
     :return: String with character added to the end if not there yet
     :rtype: str
     """
-    if not host:
+    if not host or host.endswith(override_character):
         return host
-    if host[-1] != override_character:
-        return f"{host}{override_character}"
-    return host
+    return f"{host}{override_character}"
 
 
 def remove_slash_from_the_end_of_url(host: str, override_character: str = "/") -> str:
@@ -285,7 +343,7 @@ def remove_slash_from_the_end_of_url(host: str, override_character: str = "/") -
     :return: Substring without the character
     :rtype: str
     """
-    return host[:-1] if host[-1] == override_character else host
+    return host[:-1] if host.endswith(override_character) else host
 
 
 def get_random_whole_number(number_a: int, number_b: int) -> int:
@@ -313,11 +371,13 @@ def get_random_list_items(array: list, number_of_items: int = 1, default=None) -
     if not array:
         return default
 
-    random_indexes = list(range(len(array)))
-    random.shuffle(random_indexes)
-    indexes = random_indexes[:number_of_items]
-
-    return [array[i] for i in indexes]
+    # same count as the [:number_of_items] slice of a shuffled list: capped at the list length,
+    # a negative value leaves that many items out
+    if number_of_items >= 0:
+        count = min(number_of_items, len(array))
+    else:
+        count = max(0, len(array) + number_of_items)
+    return random.sample(array, count)
 
 
 def get_random_list_item(array: list, default=None):
@@ -328,7 +388,7 @@ def get_random_list_item(array: list, default=None):
     :return: Random list item from parameter list or default
     :rtype: int
     """
-    return get_random_list_items(array, 1)[0] if array else default
+    return random.choice(array) if array else default
 
 
 def question_or_ampersand(url: str) -> str:
@@ -349,7 +409,7 @@ def get_random_str_of_characters(str_of_letters: str, number_of_characters: int
     :return: String made up of random characters chosen from passed in pool
     :rtype: str
     """
-    return ''.join(random.choice(str_of_letters) for _ in range(number_of_characters))
+    return ''.join(random.choices(str_of_letters, k=number_of_characters))
 
 
 def get_random_str(number_of_characters: int = 10, allow_upper_case: bool = False) -> str:
@@ -430,7 +490,7 @@ def get_string_from_text_matching_regex(regex: str, text: str, match_group_index
     :param any default:
     :return: Substring matching specified regular expression or default
     """
-    regex_checker = re.compile(regex)
+    regex_checker = _compile_regex(regex)
     try:
         if match := regex_checker.search(text):
             return match[match_group_index]
@@ -447,7 +507,7 @@ def get_multiple_strings_from_text_matching_regex(regex: str, text: str, default
     :param any default: defaults to "" (empty str)
     :return: All substring matching specified regular expression, or default
     """
-    regex_checker = re.compile(regex)
+    regex_checker = _compile_regex(regex)
     try:
         match = regex_checker.search(text)
         return match.groups() if match and match.groups() else default
@@ -464,7 +524,7 @@ def check_str_matching_regex(regex: str, text: str) -> bool:
     :return: True if str matches regex, False otherwise
     """
     log.debug(f'checking "{text}" against regex "{regex}"')
-    pattern = re.compile(regex)
+    pattern = _compile_regex(regex)
     return bool(pattern.match(text))
 
 
@@ -482,7 +542,7 @@ def convert_url_template_to_regex(url_template: str, escaped: bool = False) -> s
     # As a result, '!', '"', '%', "'", ',', '/', ':', ';', '<', '=', '>', '@', and "`" are no longer escaped.
     # source: https://docs.python.org/3/library/re.html#re.escape
     log.debug(f'revised url template: {revised_url_template}')
-    url_regex = re.sub(r'\\{[a-zA-Z0-9_\-]+\\}', '(.*)', revised_url_template)
+    url_regex = _URL_TEMPLATE_PARAM_RE.sub('(.*)', revised_url_template)
 
     log.debug(f'converted: {url_regex}')
     return url_regex
@@ -573,13 +633,11 @@ def get_random_special_str(number_of_characters: int = 20, excluded_list: List[s
 
     if forced_prefix:
         alphanumeric_prefix = forced_prefix[:number_of_characters]
-        special_prefix = ''.join(random.choice(specials) for _ in range(number_of_characters - len(forced_prefix)))
+        special_prefix = ''.join(random.choices(specials, k=number_of_characters - len(forced_prefix)))
     else:
         random_alphanumeric_length = 5
         alphanumeric_prefix = get_random_str(number_of_characters=random_alphanumeric_length, allow_upper_case=True)
-        special_prefix = ''.join(
-            random.choice(specials) for _ in range(number_of_characters - random_alphanumeric_length)
-        )
+        special_prefix = ''.join(random.choices(specials, k=number_of_characters - random_alphanumeric_length))
 
     return f'{alphanumeric_prefix}{special_prefix}'
 
@@ -604,6 +662,12 @@ def load_json_with_default(json_text: str, default):
         if json_text.endswith('\''):
             json_text = f'{json_text[:-1]}"'
 
+        if orjson is not None:
+            try:
+                return orjson.loads(json_text)
+            except ValueError:
+                # orjson rejects some documents json accepts (NaN, integers over 64 bits)
+                pass
         return json.loads(json_text)
     except (json.decoder.JSONDecodeError, AttributeError):
         return default
@@ -620,6 +684,9 @@ def unique(seq):
     return [x for x in seq if x not in seen and not seen.add(x)]
 
 
+_MISSING = object()
+
+
 def get_unique_list_entries_from_list_of_dicts_for_key(list_of_dicts: List[dict], key: str) -> list:
     """ Returns the unique values for a given key from a list of dictionaries
 
@@ -628,8 +695,10 @@ def get_unique_list_entries_from_list_of_dicts_for_key(list_of_dicts: List[dict]
     :return: A list of all unique values for a given key in a list of dictionaries
     :rtype: list
     """
-    all_entries_for_key = [entry.get(key, []) for entry in list_of_dicts]
-    return unique(all_entries_for_key)
+    # dicts without the key are skipped
+    values = dict.fromkeys(entry.get(key, _MISSING) for entry in list_of_dicts)
+    values.pop(_MISSING, None)
+    return list(values)
 
 
 def get_url_without_query_suffix(url: str) -> str:
@@ -682,6 +751,9 @@ def get_path_from_url(url: str) -> str:
     return parsed_url.path
 
 
+_TRUE_STRINGS = frozenset({'true', '1', 't', 'y', 'yes', 'yeah', 'yup', 'certainly', 'uh-huh'})
+
+
 def convert_str_to_boolean(str_value: str) -> bool:
     """ Converts a string to a boolean value.
     It accepts strings such as 'True', 'False', 'yes', and others, and returns the appropriate boolean value.
@@ -691,8 +763,7 @@ def convert_str_to_boolean(str_value: str) -> bool:
     :rtype: bool
     """
     try:
-        return str_value.lower() in {'true', '1', 't', 'y', 'yes', 'yeah', 'yup', 'certainly', 'uh-huh'}
-
+        return str_value.lower() in _TRUE_STRINGS
     except AttributeError:
         return False
 
@@ -703,7 +774,13 @@ def extend_list_without_duplicates(list_to_extend: list, new_list: list):
     :param list_to_extend:
     :param list new_list:
     """
-    list_to_extend.extend([entry for entry in new_list if entry not in list_to_extend])
+    try:
+        existing = set(list_to_extend)
+        new_entries = [entry for entry in new_list if entry not in existing]
+    except TypeError:
+        # unhashable entries, scan the list
+        new_entries = [entry for entry in new_list if entry not in list_to_extend]
+    list_to_extend.extend(new_entries)
 
 
 def search_list_of_substrings_in_string(
@@ -716,25 +793,25 @@ def search_list_of_substrings_in_string(
     :return: List of substrings NOT found in original string
     :rtype: List[str]
     """
-    if ignored_substrings is None:
-        ignored_substrings = []
+    ignored = frozenset(ignored_substrings or ())
 
     start_index = 0
     list_not_found_substrings = []
-    log.debug(f'looking for {list_of_substrings} in container string: {search_in_string}')
+    # lazy formatting, the container string can be large and these run once per substring
+    log.debug('looking for %s in container string: %s', list_of_substrings, search_in_string)
     for substring in list_of_substrings:
         # ignoring substring
-        if substring in ignored_substrings:
-            log.debug(f'substring in ignore list "{ignored_substrings}", skipping: {substring}')
+        if substring in ignored:
+            log.debug('substring in ignore list "%s", skipping: %s', ignored_substrings, substring)
             continue
 
         found_index = search_in_string.find(substring, start_index)
-        log.debug(f'{substring} in container string at index {found_index}')
+        log.debug('%s in container string at index %s', substring, found_index)
         if found_index >= 0:
             start_index = found_index
         else:
             list_not_found_substrings.append(substring)
-    log.debug(f'not found: {list_not_found_substrings}')
+    log.debug('not found: %s', list_not_found_substrings)
     return list_not_found_substrings
 
 
@@ -753,10 +830,11 @@ def get_cookie_with_name(driver, cookie_name):
 def run_shell_command(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                         universal_newlines=True, check=False, timeout=None, shell=False):
     """ This function will run a shell command
-    :param cmd: list of cmd arguments
+    :param cmd: list of cmd arguments, or a command string that will be split shell-style
     :return: retval object of subprocess run
     """
-    cmd = [c for c in cmd.split(' ')]
+    if isinstance(cmd, str) and not shell:
+        cmd = shlex.split(cmd)
     return subprocess.run(
         cmd,
         stdout=stdout,
@@ -790,10 +868,9 @@ def run_bash_w_live_output(cmd, log_file):
     log_output_thread = threading.Thread(target=log_to_stdout, args=(log_output_run, log_file))
     log_output_thread.start()
     with subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True) as pro:
-        returncode = None
-        while returncode is None:
-            returncode = pro.poll()
-            time.sleep(5)
+        # blocks until exit, draining stdout so a chatty command can't fill the pipe and hang
+        pro.communicate()
+        returncode = pro.returncode
     log_output_run.clear()
     log_output_thread.join()
     return returncode == 0
@@ -804,35 +881,49 @@ def log_to_stdout(log_output_run, log_file):
     :param str log_file: log file that will be read
     """
     with open(log_file, "r", encoding='utf8') as debug_log:
-        while log_output_run.is_set():
-            line = debug_log.readline()
-            if not line:
-                time.sleep(0.1)
+        # read whatever was appended in one go, the last piece may be an incomplete line
+        partial_line = ""
+        while True:
+            running = log_output_run.is_set()
+            data = debug_log.read(LOG_READ_SIZE)
+            if data:
+                lines = (partial_line + data).split("\n")
+                partial_line = lines.pop()
+                for line in lines:
+                    log.info(line.strip())
                 continue
-            log.info(line.strip())
+            # once stopped, return after the output written so far has been logged
+            if not running:
+                break
+            time.sleep(0.1)
+        if partial_line:
+            log.info(partial_line.strip())
 
 def filetime_to_string(file_time):
     """Converts a time_ns (in units of nanoseconds counting from
     Jan 1, 1970 into a human-readable string.
     """
-    unix_time_secs = int(file_time / 1000000000)
-    unix_time_ns = file_time - (unix_time_secs * 1000000000)
-    # debug(f"file_time: {file_time}")
-    # debug(f"unix_time_secs: {unix_time_secs}")
-    # debug(f"unix_time_ns: {unix_time_ns}")
+    # integer split, no float division losing precision on large values
+    unix_time_secs, unix_time_ns = divmod(file_time, 1000000000)
     # Match the time format of hydra logs
-    l_time = time.localtime(unix_time_secs)
-    ns_string = "{:<08d}".format(unix_time_ns)
-    output = f"{time.strftime('%Y-%m-%d %H:%M:%S', l_time)}.{ns_string}"
+    output = f"{_local_time_string(unix_time_secs)}.{unix_time_ns:09d}"
     return output
 
 
+@lru_cache(maxsize=1)
+def _local_time_string(unix_time_secs):
+    """ Formats whole seconds as local time, log lines come in runs within the same second
+    so only the last one is kept
+
+    :param int unix_time_secs:
+    :rtype: str
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(unix_time_secs))
+
+
 def random_string(length, charset=string.ascii_letters):
     """Generate a random string of the specified length"""
-    result = ""
-    for _ in range(length):
-        result += random.choice(charset)
-    return result
+    return "".join(random.choices(charset, k=length))
 
 
 def random_dir_string(depth=None, random_depth_range=(1, 4)):
@@ -845,10 +936,9 @@ def random_dir_string(depth=None, random_depth_range=(1, 4)):
     """
     if depth is None:
         depth = random.randint(*random_depth_range)
-    path_str = ""
-    for _ in range(depth):
-        path_str = os.path.join(path_str, random_string(4))
-    return path_str
+    # all the characters in one draw, then sliced into the 4 character directory names
+    chars = random_string(depth * 4)
+    return os.sep.join(chars[i:i + 4] for i in range(0, depth * 4, 4))
 
 
 def random_file_string(depth=None, random_depth_range=(1, 4)):
@@ -877,77 +967,229 @@ def convert_size(size_bytes):
     if size_bytes == 0:
         return "0B"
     size_name = ("B", "KiB", "MiB", "GiB", "TiB", "PiB", "EiB", "ZiB", "YiB")
-    try:
-        i_size = int(math.floor(math.log(size_bytes, 1024)))
-    except Exception as exc:
-        log.exception(f"unable to convert size: {size_bytes}")
-        raise AssertionError from exc
-    p_size = math.pow(1024, i_size)
+    if isinstance(size_bytes, int) and size_bytes > 0:
+        # 1024 is 2**10, the unit is given by the bit length, no float log rounding at the boundaries
+        i_size = min((size_bytes.bit_length() - 1) // 10, len(size_name) - 1)
+    else:
+        try:
+            i_size = int(math.floor(math.log(size_bytes, 1024)))
+        except Exception as exc:
+            log.exception(f"unable to convert size: {size_bytes}")
+            raise AssertionError from exc
+    p_size = 1024 ** i_size
     s_size = round(size_bytes / p_size, 2)
     return "%s %s" % (s_size, size_name[i_size])
 
 
+_DICT_KEY = object()
+
+
+def _comparison_key(item):
+    """ Returns a hashable key equal for items that compare equal, dicts are keyed by their items
+
+    :param any item:
+    :return: item itself or a key for dicts
+    :raises TypeError: if the item (or a dict value) is unhashable
+    """
+    if isinstance(item, dict):
+        return _DICT_KEY, frozenset(item.items())
+    hash(item)
+    return item
+
+
 def compare_two_lists(list1: list, list2: list) -> bool:
     """Compare two lists of dictionaries and logs the difference.
     :param list1: first list.
     :param list2: second list.
     :return:      if there is difference between both lists.
     """
-    diff = [i for i in list1 + list2 if i not in list1 or i not in list2]
+    try:
+        keys1 = set(map(_comparison_key, list1))
+        keys2 = set(map(_comparison_key, list2))
+        diff = [i for i in list1 if _comparison_key(i) not in keys2]
+        diff += [i for i in list2 if _comparison_key(i) not in keys1]
+    except TypeError:
+        # unhashable items, scan the lists
+        diff = [i for i in list1 + list2 if i not in list1 or i not in list2]
     result = len(diff) == 0
     if not result:
         log.info(f"** {len(diff)} difference(s) found: {diff[:5]}")
     return result
 
 
-def compare_xattr_settings(test_full_path, reference_full_path, file_or_dir):
+def _get_xattrs(path):
+    """ Returns the xattrs of a path, symlinks are not followed
+
+    Names are sorted, listxattr order depends on the filesystem and the dicts end up in the logs
+
+    :param str path:
+    :return: xattr values keyed by name
+    :rtype: dict
+    """
+    getxattr = os.getxattr
+    return {name: getxattr(path, name, follow_symlinks=False)
+            for name in sorted(os.listxattr(path, follow_symlinks=False))}
+
+
+@lru_cache(maxsize=XATTR_CACHE_SIZE)
+def _get_reference_xattrs(path, st_dev, st_ino, st_ctime_ns):
+    """ Returns the xattrs of a reference path, memoized by inode and ctime
+
+    setxattr/removexattr bump the ctime (not the mtime), so a changed reference gets a new key
+
+    :param str path:
+    :param int st_dev:
+    :param int st_ino:
+    :param int st_ctime_ns:
+    :return: xattr values keyed by name, must not be modified
+    :rtype: dict
+    """
+    return _get_xattrs(path)
+
+
+def _get_xattr_or_none(path, name):
+    """ Returns an xattr value of a path, symlinks are not followed
+
+    :param str path:
+    :param str name:
+    :return: xattr value or None if the path has no such attribute
+    :rtype: bytes
+    """
+    try:
+        return os.getxattr(path, name, follow_symlinks=False)
+    except OSError as exc:
+        if exc.errno != errno.ENODATA:
+            raise
+        return None
+
+
+def compare_xattr_settings(test_full_path, reference_full_path, file_or_dir, cache_reference=False, xattr_names=None):
     """Compare xattr settings between test full path and reference full path
     specified. It is a common method for both file and dir.
     You specify 'file' or 'dir' so that it will be referred correctly
     in the log messages.
 
+    With cache_reference set, the reference xattrs are read once and reused while the
+    reference inode is unchanged, for comparing one reference tree against several targets
+
+    With xattr_names set, only those attributes are compared and neither side is listed,
+    for trees where the set of names is known up front (cache_reference is then not used)
+
     returns False if the comparison fails
     """
     # log(f"** Comparing {file_or_dir} xattr settings:")
     # log(f"** test {file_or_dir}: {test_full_path}")
     # log(f"**  ref {file_or_dir}: {reference_full_path}")
-    reference_dict_list = []
-    reference_names = os.listxattr(
-        f"{reference_full_path}", follow_symlinks=False
-    )
-    value = b""
-    temp_dict = {}
-    for reference_name in reference_names:
-        value = os.getxattr(
-            reference_full_path, reference_name, follow_symlinks=False
+    # bound once, the value fetches below run once per attribute
+    getxattr = os.getxattr
+    # encoded once, os.getxattr re-encodes a str path on every call
+    reference_path = os.fsencode(reference_full_path)
+    test_path = os.fsencode(test_full_path)
+    if xattr_names is not None:
+        # only the given names, no listxattr on either side, an absent attribute reads as None
+        matched = all(
+            _get_xattr_or_none(reference_path, name) == _get_xattr_or_none(test_path, name)
+            for name in xattr_names
+        )
+    else:
+        if cache_reference:
+            ref_stat = os.stat(reference_full_path, follow_symlinks=False)
+            reference_xattrs = _get_reference_xattrs(
+                reference_full_path, ref_stat.st_dev, ref_stat.st_ino, ref_stat.st_ctime_ns
+            )
+            reference_names = list(reference_xattrs)
+            get_reference_xattr = reference_xattrs.__getitem__
+        else:
+            reference_names = os.listxattr(reference_path, follow_symlinks=False)
+            get_reference_xattr = lambda name: getxattr(reference_path, name, follow_symlinks=False)
+        test_names = os.listxattr(test_path, follow_symlinks=False)
+        if not reference_names and not test_names:
+            # the common case, no xattrs on either side
+            return True
+        # names first, the values are only fetched when both sides have the same attributes
+        # and the fetch stops at the first differing value
+        matched = sorted(reference_names) == sorted(test_names) and all(
+            get_reference_xattr(name) == getxattr(test_path, name, follow_symlinks=False)
+            for name in reference_names
         )
-        temp_dict[reference_name] = value
-        reference_dict_list.append(temp_dict.copy())
-        temp_dict = {}
-    test_dict_list = []
-    test_names = os.listxattr(f"{test_full_path}", follow_symlinks=False)
-    value = b""
-    temp_dict = {}
-    for test_name in test_names:
-        value = os.getxattr(test_full_path, test_name, follow_symlinks=False)
-        temp_dict[test_name] = value
-        test_dict_list.append(temp_dict.copy())
-        temp_dict = {}
-    if not compare_two_lists(reference_dict_list, test_dict_list):
+    if not matched:
+        reference_xattrs = _get_xattrs(reference_full_path)
+        test_xattrs = _get_xattrs(test_full_path)
+        compared_names = reference_xattrs.keys() | test_xattrs.keys() if xattr_names is None else xattr_names
+        diff = sorted(name for name in compared_names if reference_xattrs.get(name) != test_xattrs.get(name))
         log.info(f"** Mismatch comparing {file_or_dir} xattr settings:")
         log.info(f"** test {file_or_dir}: {test_full_path}")
         log.info(f"**  ref {file_or_dir}: {reference_full_path}")
-        log.info(f"xattr {file_or_dir} mismatch:")
-        log.info(f"** test xattr: {test_dict_list}")
-        log.info(f"**  ref xattr: {reference_dict_list}")
+        log.info(f"xattr {file_or_dir} mismatch: {diff}")
+        log.info(f"** test xattr: {test_xattrs}")
+        log.info(f"**  ref xattr: {reference_xattrs}")
         return False
     return True
 
 
-def collect_diags(test_name, clusters=None):
+def compare_xattr_settings_many(path_pairs, file_or_dir, max_workers=XATTR_COMPARE_WORKERS, cache_reference=False,
+                                xattr_names=None):
+    """ Compare the xattr settings of many test/reference path pairs
+
+    The pairs are compared on a thread pool, os.getxattr releases the GIL so the
+    xattr syscalls of different files overlap
+
+    :param list path_pairs: (test_full_path, reference_full_path) tuples
+    :param str file_or_dir: 'file' or 'dir', used in the log messages
+    :param int max_workers: upper bound on the concurrent comparisons
+    :param bool cache_reference: reuse the reference xattrs across calls, see compare_xattr_settings
+    :param list xattr_names: only compare these attributes, see compare_xattr_settings
+    :return: False if any of the comparisons fails
+    :rtype: bool
+    """
+    path_pairs = list(path_pairs)
+    if not path_pairs:
+        return True
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(path_pairs))) as executor:
+        results = list(executor.map(
+            lambda pair: compare_xattr_settings(pair[0], pair[1], file_or_dir, cache_reference, xattr_names),
+            path_pairs
+        ))
+    return all(results)
+
+
+def compare_xattrs_bulk(reference_root, test_root, max_workers=XATTR_COMPARE_WORKERS, cache_reference=False,
+                        xattr_names=None):
+    """ Compare the xattr settings of a whole tree, every dir and file under reference_root
+    is compared with the entry at the same relative path under test_root
+
+    The walk is done once up front and the comparisons are batched through compare_xattr_settings_many
+
+    :param str reference_root:
+    :param str test_root:
+    :param int max_workers: upper bound on the concurrent comparisons
+    :param bool cache_reference: reuse the reference xattrs across calls, see compare_xattr_settings
+    :param list xattr_names: only compare these attributes, see compare_xattr_settings
+    :return: False if any of the comparisons fails
+    :rtype: bool
+    """
+    dir_pairs = [(test_root, reference_root)]
+    file_pairs = []
+    for root, dirs, files in os.walk(reference_root):
+        test_dir = os.path.normpath(os.path.join(test_root, os.path.relpath(root, reference_root)))
+        dir_pairs.extend((os.path.join(test_dir, name), os.path.join(root, name)) for name in dirs)
+        file_pairs.extend((os.path.join(test_dir, name), os.path.join(root, name)) for name in files)
+    dirs_matched = compare_xattr_settings_many(dir_pairs, "dir", max_workers, cache_reference, xattr_names)
+    files_matched = compare_xattr_settings_many(file_pairs, "file", max_workers, cache_reference, xattr_names)
+    return dirs_matched and files_matched
+
+
+def collect_diags(test_name, clusters=None, max_workers=DIAG_COLLECT_WORKERS):
+    """ Collect the diags of the clusters, the clusters are independent so they are collected concurrently
+
+    :param str test_name:
+    :param list clusters: Cluster objects
+    :param int max_workers: upper bound on the clusters collected at once
+    """
     if clusters:
-        for cluster in clusters:
-            cluster.collect_diags(test_name)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(clusters))) as executor:
+            # consuming the results re-raises the first failure, as the serial loop did
+            list(executor.map(lambda cluster: cluster.collect_diags(test_name), clusters))
 
 def formatter(numeric_val, unit_defs):
     """Format a number based on unit definitions."""